@@ -0,0 +1,55 @@
+import argparse
+import gc
+import os.path
+import statistics
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(here), 'src'))
+import parse
+
+argparser = argparse.ArgumentParser(description='Time the Quill parser on generated programs of growing size')
+argparser.add_argument('shapes', nargs='*', help='statements, array or call, all of them if left out')
+argparser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='statements or items per program')
+argparser.add_argument('--repeat', type=int, default=3, help='parses per shape and size')
+argparser.add_argument('--threshold', type=float, default=2.0, help='how many times the smallest size\'s cost per item the largest may take before it counts as nonlinear')
+args = argparser.parse_args()
+
+# each shape is one line per statement or one long list, the parts that used to be quadratic
+shapes = {
+    'statements':lambda n: '\n'.join(f'x = {i}' for i in range(n)),
+    'array':lambda n: f'table = [{", ".join(str(i) for i in range(n))}]',
+    'call':lambda n: f'f({", ".join(str(i) for i in range(n))})',
+}
+
+def bench(code):
+    times = []
+    for _ in range(args.repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse.Parser().parse(parse.Lexer().tokenize(code))
+        times.append(time.perf_counter() - start) # the tree is freed outside the timing
+    return statistics.median(times)
+
+names = args.shapes or list(shapes)
+for name in names:
+    if name not in shapes:
+        sys.exit(f'No parser benchmark called {name}, pick from {", ".join(shapes)}')
+sizes = sorted(args.sizes)
+
+nonlinear = []
+print(f'{"shape":<12} {"size":>9} {"median":>9} {"per item":>10}')
+for name in names:
+    costs = []
+    for size in sizes:
+        spent = bench(shapes[name](size))
+        costs.append(spent / size)
+        print(f'{name:<12} {size:>9} {spent:>8.3f}s {costs[-1] * 1e6:>8.2f}us')
+    growth = costs[-1] / costs[0]
+    if len(sizes) > 1 and growth > args.threshold:
+        print(f'{name:<12} cost per item grew {growth:.1f}x from {sizes[0]} to {sizes[-1]}, NONLINEAR')
+        nonlinear.append(name)
+
+if nonlinear:
+    sys.exit(f'Parsing is not linear for {", ".join(nonlinear)}')
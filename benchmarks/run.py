@@ -0,0 +1,100 @@
+import argparse
+import glob
+import json
+import os.path
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+argparser = argparse.ArgumentParser(description='Run the Quill benchmarks')
+argparser.add_argument('names', nargs='*', help='benchmarks to run, all of them if left out')
+argparser.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+argparser.add_argument('--vm', action='store_true', help='run the benchmarks on the bytecode vm')
+argparser.add_argument('--out', default=os.path.join(here, 'results.json'), help='where to write the results')
+argparser.add_argument('--baseline', default=os.path.join(here, 'baseline.json'), help='results to compare against')
+argparser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+argparser.add_argument('--threshold', type=float, default=0.15, help='how much slower than the baseline median counts as a regression')
+args = argparser.parse_args()
+
+# every run is a fresh interpreter, so each time includes startup. The first run of each
+# benchmark fills __qylcache__ and is thrown away, except for cold ones that clear it every time
+cold = {'startup'}
+
+def run(path):
+    command = [sys.executable, os.path.join(root, 'main.py'), path]
+    if args.vm:
+        command.insert(2, '--vm')
+    start = time.perf_counter()
+    proc = subprocess.run(command, cwd=root, capture_output=True, text=True)
+    spent = time.perf_counter() - start
+    if proc.returncode:
+        sys.exit(f'{os.path.basename(path)} failed:\n{proc.stderr}')
+    return spent, proc.stdout
+
+def clear():
+    subprocess.run([sys.executable, os.path.join(root, 'main.py'), '--clear-cache'], cwd=here, capture_output=True)
+
+def bench(name):
+    path = os.path.join(here, f'{name}.qyl')
+    if name not in cold:
+        run(path)
+    times = []
+    output = None
+    for _ in range(args.repeat):
+        if name in cold:
+            clear()
+        spent, out = run(path)
+        if output is not None and out != output:
+            sys.exit(f'{name} printed different output between runs')
+        output = out
+        times.append(spent)
+    return {
+        'median':statistics.median(times),
+        'min':min(times),
+        'max':max(times),
+        'stdev':statistics.stdev(times) if len(times) > 1 else 0.0,
+        'times':times,
+    }
+
+names = args.names or sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(here, '*.qyl')))
+results = {
+    'engine':'vm' if args.vm else 'tree',
+    'python':platform.python_version(),
+    'repeat':args.repeat,
+    'benchmarks':{},
+}
+baseline = {}
+if os.path.isfile(args.baseline):
+    with open(args.baseline) as f:
+        saved = json.load(f)
+    if saved.get('engine') == results['engine']:
+        baseline = saved['benchmarks']
+
+regressions = []
+print(f'{"benchmark":<16} {"median":>9} {"spread":>9} {"baseline":>9}')
+for name in names:
+    result = bench(name)
+    results['benchmarks'][name] = result
+    line = f'{name:<16} {result["median"]:>8.3f}s {result["max"] - result["min"]:>8.3f}s'
+    if name in baseline:
+        before = baseline[name]['median']
+        change = result['median'] / before - 1
+        line += f' {before:>8.3f}s {change:+.1%}'
+        if change > args.threshold:
+            line += ' REGRESSION'
+            regressions.append(name)
+    print(line)
+
+with open(args.out, 'w') as f:
+    json.dump(results, f, indent=1)
+if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+        json.dump(results, f, indent=1)
+
+if regressions:
+    sys.exit(f'{len(regressions)} regression{"s" if len(regressions) != 1 else ""} over {args.threshold:.0%}: {", ".join(regressions)}')
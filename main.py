@@ -1,9 +1,59 @@
+import time
+started = time.perf_counter()
 import sys
-sys.path.append((__file__.rstrip('/main.py') + '/src').lstrip('/'))
+import os.path
+import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
 
+def formatter(prog): # argparse would import shutil just to find the terminal width
+    try:
+        width = os.get_terminal_size().columns
+    except OSError:
+        width = 80
+    return argparse.HelpFormatter(prog, width=width - 2)
+
+argparser = argparse.ArgumentParser(description='Quill interpreter', formatter_class=formatter)
+argparser.add_argument('file', nargs='?', help='script to run, starts the repl if left out')
+argparser.add_argument('--vm', action='store_true', help='run on the bytecode vm instead of the tree walker')
+argparser.add_argument('--no-cache', action='store_true', help='always reparse sources instead of using __qylcache__')
+argparser.add_argument('--profile', action='store_true', help='report time and calls per func and per line when the script ends')
+argparser.add_argument('--profile-dump', metavar='FILE', help='also write the profile to FILE as json')
+argparser.add_argument('--trace', action='store_true', help='print call, return, statement and exception events to stderr as the script runs')
+argparser.add_argument('--trace-events', metavar='EVENTS', help='only trace these comma separated events')
+argparser.add_argument('--startup-stats', action='store_true', help='print how long each phase of starting up and running took')
+argparser.add_argument('--clear-cache', action='store_true', help='delete the __qylcache__ directories under the script\'s directory, the working directory and the install, parser tables included')
+argparser.add_argument('--serve', action='store_true', help='keep a warm interpreter running the scripts sent to it with --client')
+argparser.add_argument('--client', action='store_true', help='run the script on the interpreter started with --serve')
+argparser.add_argument('--socket', metavar='PATH', help='unix socket for --serve and --client, by default $QUILL_SOCKET, or quill.sock in $XDG_RUNTIME_DIR or in a private quill-<uid> directory in the temp directory')
+args = argparser.parse_args()
+
+if (args.client or args.serve) and (args.profile or args.profile_dump or args.trace or args.trace_events or args.startup_stats or args.clear_cache):
+    argparser.error('--serve and --client only take --vm and --no-cache')
+if args.serve and args.file:
+    argparser.error('--serve takes its scripts from --client')
+if args.client: # hands the script over before anything heavy is imported
+    import daemon
+    if not args.file:
+        argparser.error('--client needs a script to run')
+    daemon.supported()
+    sys.exit(daemon.client(args.file, args.socket or daemon.address(), args.vm, args.no_cache))
+
+mark = time.perf_counter()
+import threading
+import data
 import parse
 import runner
 import errors
+import cache
+import resolve
+
+tables = 'parser tables (cached)' if parse.tables_cached else 'parser tables (built)'
+phases = [('arguments', mark - started), ('imports', time.perf_counter() - mark - parse.table_time), (tables, parse.table_time)]
+def phase(name, since):
+    now = time.perf_counter()
+    phases.append((name, now - since))
+    return now
+mark = time.perf_counter()
 
 def getline():
     try:
@@ -15,27 +65,134 @@ def getline():
     except EOFError:
         sys.exit(0)
 
-if sys.argv[1:]:
 
-    l = parse.Lexer()
-    p = parse.Parser()
+if args.trace_events:
+    args.trace = True
+if args.trace and (args.profile or args.profile_dump):
+    argparser.error('--trace and --profile cannot be used together')
 
-    code = open(sys.argv[1]).read()
+if args.no_cache:
+    cache.enabled = False
+if args.clear_cache:
+    dirs = [os.getcwd(), runner.root] # and everything below them, where imported modules are found
+    if args.file:
+        dirs.append(os.path.dirname(os.path.abspath(args.file)))
+    cache.clear(*dirs)
+    if not args.file:
+        sys.exit(0)
 
-    tree = p.parse(l.tokenize(code))
-    runner.run(tree)
+if args.profile or args.profile_dump:
+    import profiler
+    profiler.start() # statements are timed by the tree walker, so this ignores --vm
+    Program = runner.Program
+elif args.vm:
+    import vm
+    Program = vm.Program
 else:
-    print('Quill v 1.0')
-    errors.setno()
-
-    l = parse.Lexer()
-    p = parse.Parser()
-
-    program = runner.Program(parse.Node('program'))
-    while True:
-        code = getline()
-        tree = p.parse(l.tokenize(code))
-        program.ast = tree
-        val = program.run()
-        if val:
-            program.print(val)
+    Program = runner.Program
+
+def trace(event, name, file, line, arg):
+    out = f'{event} {name} {runner.relative(file)}:{line}'
+    if event == 'return' and isinstance(arg, data.TailCall):
+        out += ' -> tail call'
+    elif event == 'return' and arg is not None:
+        out += f' -> {data.text(arg)}'
+    elif event == 'exception':
+        out += f' {type(arg).__name__} {arg}'
+    print(out, file=sys.stderr)
+
+if args.trace:
+    for event in (args.trace_events or ','.join(runner.events)).split(','):
+        Program.hook(event.strip(), trace)
+
+mark = phase('options', mark)
+
+# every quill call nests a handful of python calls, so scripts run on a thread with room for
+# deep recursion. What it returns or raises is handed back here as if fn had been called
+# directly, and ctrl-c still reaches the main thread, which takes the process down with it
+def deep(fn, *args):
+    result = {}
+    def target():
+        try:
+            result['val'] = fn(*args)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result.get('val')
+
+def script():
+    since = time.perf_counter()
+    try:
+        tree = cache.load(args.file)
+        since = phase('load script', since)
+        program = Program(tree)
+        since = phase('setup', since)
+        program.run()
+    finally:
+        phase('run', since)
+
+def main():
+    if args.file:
+        deep(script)
+    else:
+        print(f'Quill v {cache.version}')
+        errors.setno()
+
+        l = parse.Lexer()
+        p = parse.Parser()
+
+        program = Program(parse.Node('program'))
+        while True:
+            code = getline()
+            tree = resolve.resolve(p.parse(l.tokenize(code)))
+            program.ast = tree
+            val = deep(program.run)
+            if val:
+                program.print(val)
+
+def start():
+    try:
+        main()
+    finally:
+        if args.profile or args.profile_dump:
+            profiler.report()
+            if args.profile_dump:
+                profiler.dump(args.profile_dump)
+        if args.startup_stats:
+            phases.append(('total', time.perf_counter() - started))
+            for name, spent in phases:
+                print(f'{name:<24} {spent * 1000:>8.2f}ms', file=sys.stderr)
+
+def request(file, use_vm, no_cache): # runs in a process forked by the server for each --client
+    global Program
+    args.file = file
+    cache.enabled = not no_cache
+    Program = vm.Program if use_vm else runner.Program
+    try:
+        start()
+    except SystemExit as e:
+        return e.code
+
+sys.setrecursionlimit(200000)
+threading.stack_size(512 * 1024 * 1024)
+if args.serve:
+    import daemon
+    import vm
+    daemon.supported()
+    stdlib = os.path.join(runner.root, 'stdlib')
+    for name in sorted(os.listdir(stdlib)):
+        path = os.path.realpath(os.path.join(stdlib, name))
+        if name.endswith('.qyl'):
+            cache.keep(path)
+        elif name.endswith('.py'):
+            try: # only to import what it needs, each script still runs its own copy
+                exec(compile(open(path).read(), path, 'exec'), {})
+            except Exception:
+                pass
+    daemon.serve(args.socket or daemon.address(), request)
+    sys.exit(0)
+start()
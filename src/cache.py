@@ -0,0 +1,69 @@
+import hashlib
+import os
+import os.path
+import pickle
+import parse
+import resolve
+
+version = '1.0'
+# bump whenever the shape of parse.Node trees changes, old caches are then ignored
+magic = b'QYLC10'
+dirname = '__qylcache__'
+
+enabled = True
+resident = {} # source -> (code, tree), parsed once by the --serve daemon and kept in memory
+
+def path(source):
+    head, tail = os.path.split(os.path.abspath(source))
+    return os.path.join(head, dirname, os.path.splitext(tail)[0] + '.qylc')
+
+def key(source, code): # trees know their file, so the path is part of the key
+    return hashlib.sha256(f'{version}\0{source}\0{code}'.encode('utf-8')).hexdigest().encode('ascii')
+
+def parse_code(code, source=None):
+    ast = resolve.resolve(parse.Parser().parse(parse.Lexer().tokenize(code)))
+    if source is not None:
+        resolve.locate(ast, source)
+    return ast
+
+def load(source):
+    code = open(source).read()
+    source = os.path.abspath(source)
+    if not enabled:
+        return parse_code(code, source)
+    if source in resident and resident[source][0] == code:
+        return resident[source][1]
+    file = path(source)
+    header = magic + key(source, code) + b'\n'
+    try:
+        with open(file, 'rb') as f:
+            if f.readline() == header:
+                return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    ast = parse_code(code, source)
+    store(file, header, ast)
+    return ast
+
+def keep(source):
+    source = os.path.abspath(source)
+    resident[source] = (open(source).read(), load(source))
+
+def store(file, header, ast):
+    try:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f'{file}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            pickle.dump(ast, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, file)
+    except OSError:
+        pass # read only location, just run uncached
+
+def clear(*tops): # modules are imported by their path below these, so caches can be anywhere under them
+    import shutil
+    for top in tops:
+        for dir, subdirs, files in os.walk(top):
+            if dirname in subdirs:
+                shutil.rmtree(os.path.join(dir, dirname), ignore_errors=True)
+            subdirs[:] = [name for name in subdirs if name != dirname and not name.startswith('.')]
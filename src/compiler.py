@@ -0,0 +1,224 @@
+import data
+import resolve
+
+INDEX = data.intern('index')
+
+# opcodes, roughly ordered by how often the vm sees them
+LOCAL = 0
+CALL = 1
+BINARY = 2
+POP_RETURN = 3
+NUMBER = 4
+ASSIGN = 5
+NAME = 6
+BLOCK = 7
+RETURN = 8
+STRING = 9
+CHILD = 10
+CONST = 11
+LAZY = 12
+LOAD = 13
+OP = 14
+DECL = 15
+ARRAY = 16
+BOOL = 17
+NONE = 18
+TAIL = 19
+BUILTIN = 20
+UNLESS = 21
+UNTIL = 22
+STEP = 23
+LAST = 24
+JUMP = 25
+
+opnames = {
+    LOCAL:'LOCAL',
+    CALL:'CALL',
+    BINARY:'BINARY',
+    POP_RETURN:'POP_RETURN',
+    NUMBER:'NUMBER',
+    ASSIGN:'ASSIGN',
+    NAME:'NAME',
+    BLOCK:'BLOCK',
+    RETURN:'RETURN',
+    STRING:'STRING',
+    CHILD:'CHILD',
+    CONST:'CONST',
+    LAZY:'LAZY',
+    LOAD:'LOAD',
+    OP:'OP',
+    DECL:'DECL',
+    ARRAY:'ARRAY',
+    BOOL:'BOOL',
+    NONE:'NONE',
+    TAIL:'TAIL',
+    BUILTIN:'BUILTIN',
+    UNLESS:'UNLESS',
+    UNTIL:'UNTIL',
+    STEP:'STEP',
+    LAST:'LAST',
+    JUMP:'JUMP',
+}
+
+class Code():
+    def __init__(self, ops):
+        self.ops = ops
+    def __repr__(self):
+        out = ''
+        for i, (op, arg) in enumerate(self.ops):
+            out += f'{i:>4} {opnames[op]:<11}{"" if arg is None else repr(arg)}\n'
+        return out.rstrip('\n')
+
+# only while takes its arguments unevaluated, so only a callee that may be it needs the
+# LAZY check: one named while, or one computed by an expression the compiler can't see into
+def lazy(callee):
+    if callee.type in ('name', 'value'):
+        return callee.symbols[-1].val == 'while'
+    elif callee.type == 'child':
+        return callee.symbol.val == 'while'
+    return True
+
+# if (cond) { ... } and while (cond) { ... } as statements run their block in place with
+# jumps, after BUILTIN has checked the name still is the builtin for this scope. Otherwise
+# BUILTIN jumps to the plain call compiled after them
+def inlined(node):
+    if node.type != 'call':
+        return
+    name = resolve.called(node)
+    args = node.val[1].val
+    if name in resolve.shared and len(node.val[0].symbols) == 1 and len(args) == 2 and args[0].type == 'block' and args[1].type not in ('block', 'decl'):
+        return name
+
+class Compiler():
+    def __init__(self):
+        self.ops = []
+    def emit(self, op, arg=None):
+        self.ops.append((op, arg))
+        return len(self.ops) - 1
+    def program(self, node):
+        if not node.val:
+            self.emit(NONE)
+            self.emit(RETURN)
+            return
+        self.statements(node.val, (POP_RETURN, None), (RETURN, None))
+    # each is what happens to the value of every statement but the last one, which gets last
+    def statements(self, nodes, each, last):
+        for statement in nodes[:-1]:
+            self.statement(statement, each, each)
+        self.statement(nodes[-1], each, last)
+    def statement(self, node, each, this):
+        name = inlined(node)
+        if name == 'if':
+            self.inline_if(node, each)
+        elif name == 'while':
+            self.inline_while(node)
+        else:
+            self.expr(node)
+        self.emit(*this)
+    def builtin(self, node, name):
+        callee = node.val[0]
+        return self.emit(BUILTIN, (callee.layout, callee.slot, callee.symbols, name))
+    def generic(self, node, check, end):
+        jump = self.emit(JUMP)
+        self.ops[check] = (BUILTIN, (*self.ops[check][1], len(self.ops)))
+        self._call(node)
+        self.ops[jump] = (JUMP, len(self.ops))
+        if end is not None:
+            self.ops[end] = (self.ops[end][0], jump)
+    def inline_if(self, node, each):
+        block, cond = node.val[1].val
+        check = self.builtin(node, 'if')
+        self.expr(cond)
+        end = self.emit(UNLESS)
+        for statement in block.val[0].val: # a value ends the block, and so whatever runs it
+            self.statement(statement, each, each)
+        self.emit(NONE)
+        self.generic(node, check, end)
+    def inline_while(self, node):
+        block, cond = node.val[1].val
+        check = self.builtin(node, 'while')
+        self.emit(NONE) # the value of the last pass
+        head = len(self.ops)
+        self.expr(cond)
+        end = self.emit(UNTIL)
+        if block.val[0].val: # a value only ends the pass
+            self.statements(block.val[0].val, (STEP, head), (LAST, head))
+        else:
+            self.emit(NONE)
+            self.emit(LAST, head)
+        self.generic(node, check, end)
+    def arg(self, node):
+        if node.type == 'decl':
+            self.emit(CONST, node)
+        else:
+            self.expr(node)
+    def expr(self, node):
+        getattr(self, '_' + node.type, self._none)(node)
+    def _none(self, node):
+        self.emit(NONE)
+    def _string(self, node):
+        self.emit(STRING, node.val[0])
+    def _number(self, node):
+        self.emit(NUMBER, float(node.val[0]))
+    def _bool(self, node):
+        self.emit(BOOL, node.val[0] == 'true')
+    def _name(self, node):
+        self.emit(NAME, (node.layout, node.slot, node.symbols))
+    def _value(self, node):
+        if len(node.symbols) == 1:
+            self.emit(LOCAL, (node.layout, node.slot, node.symbols))
+        else:
+            self.emit(LOAD, (node.layout, node.slot, node.symbols))
+    def _decl(self, node):
+        argc = 0
+        if len(node.val) == 3:
+            argc = len(node.val[2].val)
+            for arg in node.val[2].val:
+                self.arg(arg)
+        self.emit(DECL, (node, argc))
+    def _call(self, node, call=CALL):
+        self.expr(node.val[0])
+        args = node.val[1].val
+        check = lazy(node.val[0])
+        if check:
+            start = self.emit(LAZY)
+        for arg in args:
+            if arg.type == 'decl':
+                self.emit(CONST, arg)
+            else:
+                self.expr(arg)
+        self.emit(call, len(args))
+        if check:
+            self.ops[start] = (LAZY, (tuple(args), len(self.ops)))
+    def _tail(self, node):
+        self._call(node, TAIL)
+    def _op(self, node):
+        self.expr(node.val[0])
+        self.expr(node.val[2])
+        self.emit(ASSIGN if node.val[1] in resolve.assigns else BINARY, node.symbol)
+    def _index(self, node):
+        self.expr(node.val[0])
+        self.emit(OP, INDEX)
+        self.expr(node.val[1])
+        self.emit(CALL, 1)
+    def _child(self, node):
+        self.expr(node.val[0])
+        self.emit(CHILD, node.symbol)
+    def _block(self, node):
+        self.emit(BLOCK, node.val[0])
+    def _array(self, node):
+        for item in node.val[0].val:
+            self.expr(item)
+        self.emit(ARRAY, len(node.val[0].val))
+
+def compile(node):
+    code = getattr(node, 'code', None)
+    if code is None:
+        compiler = Compiler()
+        if node.type == 'program':
+            compiler.program(node)
+        else:
+            compiler.expr(node)
+            compiler.emit(RETURN)
+        code = node.code = Code(compiler.ops)
+    return code
@@ -0,0 +1,163 @@
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+
+# --serve forks a child per request, so every script starts from the warm server as it
+# was before any script ran and nothing one script does can reach the next. The client
+# hands over its own stdin, stdout and stderr, the child writes straight to them.
+
+# the server runs whatever it is sent as the user who started it, so the socket lives in a
+# directory only that user can reach, and both ends check who is on the other side
+
+def fail(msg):
+    print(f'\033[0;31mError: {msg}\033[0;0m', file=sys.stderr)
+    return 1
+
+def supported():
+    if not hasattr(socket, 'send_fds'):
+        sys.exit(fail('--serve and --client need Python 3.9 or newer'))
+
+def private(dir):
+    try:
+        os.mkdir(dir, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(dir)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        sys.exit(fail(f'{dir} has to be a directory only you can use'))
+    return dir
+
+def address():
+    if os.environ.get('QUILL_SOCKET'):
+        return os.environ['QUILL_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'): # already private to the user
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'quill.sock')
+    return os.path.join(private(os.path.join(os.environ.get('TMPDIR') or '/tmp', f'quill-{os.getuid()}')), 'quill.sock')
+
+def trusted(conn): # where the platform can't name the peer, the directory is the only guard
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    pid, uid, gid = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid == os.getuid()
+
+def client(file, path, vm, no_cache):
+    request = json.dumps({'file':os.path.abspath(file), 'cwd':os.getcwd(), 'vm':vm, 'no_cache':no_cache})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(path)
+        except OSError as e:
+            return fail(f'No server on {path}: {e.strerror or e}')
+        if not trusted(conn):
+            return fail(f'The server on {path} belongs to another user')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        socket.send_fds(conn, [request.encode('utf-8') + b'\n'], [0, 1, 2])
+        replies = conn.makefile('r')
+        pid = None
+        try:
+            pid = replies.readline() # the child running the script, so ctrl-c can stop it
+            status = replies.readline()
+        except KeyboardInterrupt:
+            if pid:
+                os.kill(int(pid), signal.SIGTERM)
+            return 130
+    if not status:
+        return fail('The server closed the connection before the script finished')
+    return int(status)
+
+def code(status): # what sys.exit would have made of it
+    if status is None:
+        return 0
+    if isinstance(status, int):
+        return status
+    print(status, file=sys.stderr)
+    return 1
+
+def child(conn, request, fds, run):
+    status = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        conn.sendall(f'{os.getpid()}\n'.encode('ascii'))
+        request = json.loads(request)
+        os.chdir(request['cwd'])
+        status = code(run(request['file'], request['vm'], request['no_cache']))
+    except BaseException as e:
+        print(f'\033[0;31mError: {type(e).__name__} {e}\033[0;0m', file=sys.stderr)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(f'{status}\n'.encode('ascii'))
+        finally:
+            os._exit(0)
+
+def reap(*args):
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+def receive(conn):
+    request, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+    while not request.endswith(b'\n'):
+        more = conn.recv(65536)
+        if not more:
+            break
+        request += more
+    return request, fds
+
+def serve(path, run):
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except OSError: # left behind by a server that did not shut down
+                os.unlink(path)
+            else:
+                sys.exit(fail(f'A server is already running on {path}'))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    listener.listen()
+    signal.signal(signal.SIGCHLD, reap)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0)) # still removes the socket
+    print(f'Serving on {path}', file=sys.stderr)
+    try:
+        while True:
+            conn, _ = listener.accept()
+            fds = []
+            if not trusted(conn):
+                print('Refused a client run by another user', file=sys.stderr)
+                conn.close()
+                continue
+            try:
+                request, fds = receive(conn)
+                if len(fds) == 3:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    if os.fork() == 0:
+                        listener.close()
+                        child(conn, request, fds, run)
+            except OSError:
+                pass # the client went away
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(path)
@@ -1,12 +1,46 @@
 import errors
+import array
+import builtins
+import collections
 import copy
+import importlib
+import itertools
+import math
+import operator
+import re
+import sys
+import types
 
 null = None
 
+empty = types.MappingProxyType({}) # shared attrs for values that never carry user attributes
+
+symbols = {} # name -> the one canonical Symbol used for lookups
+
+def intern(name):
+    symbol = symbols.get(name)
+    if symbol is None:
+        symbol = object.__new__(Symbol)
+        symbol.val = sys.intern(name)
+        symbol.attrs = empty
+        symbols[symbol.val] = symbol
+    return symbol
+
+escapes = {'n':'\n', 'r':'\r', 't':'\t', '\\':'\\', '"':'"', '0':'\0'}
+escape = re.compile(r'\\(.)')
+
+def unescape(val):
+    return escape.sub(lambda match: escapes.get(match.group(1), match.group(0)), val)
+
+def unquote(val):
+    return unescape(val.strip('"'))
+
 def convert(val, attr, fallback):
-    if hasattr(val, 'attrs'):
-        if attr in val.attrs:
-            return get(val.attrs[attr], '_call')().val
+    if isinstance(val, Type):
+        val = ref(val)
+        method = val.methods.get(attr)
+        if method:
+            return method(val).val
         return val.val
     else:
         return fallback(val)
@@ -37,6 +71,24 @@ op_names = {
     'index':['index']
 }
 
+slot_names = {}
+
+def fields(cls):
+    if cls not in slot_names:
+        names = []
+        for base in reversed(cls.__mro__):
+            for name in base.__dict__.get('__slots__', ()):
+                if name not in names:
+                    names.append(name)
+        slot_names[cls] = names
+    return slot_names[cls]
+
+def box(type, val):
+    out = object.__new__(type)
+    out.val = val
+    out.attrs = empty
+    return out
+
 def ref(obj):
     if isinstance(obj, Reference):
         return obj.to
@@ -45,34 +97,58 @@ def ref(obj):
 def call(obj, *args):
     obj = ref(obj)
     if isinstance(obj, Method):
-        return obj.attrs['_call'](*args)
-    if get(obj, 'call', error=False):
-        return get(obj, 'call').attrs['_call'](*args)
-    elif get(obj, '_call', error=False):
-        return get(obj, '_call').attrs['_call'](*args)
+        return obj.val(*args)
+    func = get(obj, 'call', error=False) or get(obj, '_call', error=False)
+    if func:
+        return call(func, *args)
     else:
         errors.error(f'Object {obj.string().val} is not callable')
 
 def get_name(scope, name):
-    name = name.split('.')
-    while name:
-        part = name.pop(0)
+    return get_path(scope, [intern(part) for part in name.split('.')])
+
+def get_path(scope, symbols, start=0):
+    for i in range(start, len(symbols)):
+        symbol = symbols[i]
         old = scope
-        scope = get(scope, Symbol(part))
+        scope = get(scope, symbol)
         if not scope:
-            errors.error(f'Object {old.string().val} has no attribute {part}')
+            errors.error(f'Object {old.string().val} has no attribute {symbol.val}')
     return scope
 
+def get_slot(scope, layout, slot, symbols):
+    if scope.layout is not layout:
+        return get_path(scope, symbols)
+    obj = scope.load(slot, symbols[0])
+    if not obj:
+        errors.error(f'Object {scope.string().val} has no attribute {symbols[0].val}')
+    return get_path(obj, symbols, 1)
+
+# a name read for its value: the slot itself, without the Reference an assignment needs
+def get_value(scope, layout, slot, symbols):
+    if scope.layout is layout and len(symbols) == 1:
+        val = scope.slots[slot]
+        if val is not None:
+            return val
+    return ref(get_slot(scope, layout, slot, symbols))
+
 def get(obj, attr, error=True):
     if not obj:
         errors.error('Object is null')
-    attr = Symbol(attr) # select it and use ctrl-[ and ctrl-]
-    if 'get' in obj.attrs:
-        return call(obj.attrs['get'], attr)
-    elif '_get' in obj.attrs:
-        return call(obj.attrs['_get'], attr)
-    elif attr.val in obj.attrs:
-        return obj.attrs[attr.val]
+    if not isinstance(attr, Symbol):
+        attr = intern(attr) # select it and use ctrl-[ and ctrl-]
+    attrs = obj.attrs
+    if 'get' in attrs:
+        return call(attrs['get'], attr)
+    elif '_get' in attrs:
+        return call(attrs['_get'], attr)
+    getter = obj.methods.get('_get')
+    if getter:
+        return getter(obj, attr)
+    elif attr.val in attrs:
+        return attrs[attr.val]
+    elif attr.val in obj.methods:
+        return obj.methods[attr.val].__get__(obj)
     else:
         if error:
             errors.error(f'Cannot get attribute of object {obj.string().val}')
@@ -83,42 +159,100 @@ def op(obj, op):
     if not obj:
         errors.error('Object is null')
     if op.val not in obj.attrs:
-        if op.val in op_names:
-            for name in op_names[op.val]:
+        if op.val in op_symbols:
+            for name, private in op_symbols[op.val]:
                 if get(obj, name, error=False):
-                    return get(obj, Symbol(name))
-                elif get(obj, '_' + name, error=False):
-                    return get(obj, Symbol('_' + name))
+                    return get(obj, name)
+                elif get(obj, private, error=False):
+                    return get(obj, private)
                 else:
                     errors.error(f'{obj.string().val} does not have operator {op.string().val}')
         else:
-            return get(obj, Symbol(op))
+            return get(obj, op)
 
 def copy(obj):
     if isinstance(obj, List):
-        return List(obj.type, *obj.val)
+        return obj.clone()
     elif isinstance(obj, Block):
         return Block(obj.val, obj.parent)
+    elif isinstance(obj, Scope):
+        return obj # shares its attrs anyway, and the slots have to stay in step with them
     elif isinstance(obj, Map):
         out = Map(obj.key_t, obj.val_t)
         out.attrs = obj.attrs
+        out.val = obj.val # entries are shared like attrs, copies are views of one map
         return out
     else:
-        return type(obj)(obj.val)
+        out = object.__new__(type(obj))
+        for name in fields(type(obj)):
+            setattr(out, name, getattr(obj, name))
+        return out
+
+def iterate(obj):
+    obj = ref(obj)
+    method = obj.methods.get('_iter')
+    if method is None:
+        errors.error(f'Cannot iterate over {obj.typename}')
+        return iter(())
+    return method(obj)
+
+# iteration shared by everything with an _iter, the adapters stream without building lists
+def each(obj, block, decl):
+    type, name = decl.val
+    for item in iterate(obj):
+        block.val.globals.bind(name, item)
+        block.val.run()
+
+def pair(a, b):
+    out = object.__new__(List)
+    out.val = [a, b]
+    out.type = Type
+    out.attrs = empty
+    return out
+
+def stream(obj):
+    return Iterator(iterate(obj))
+
+def lazy_map(obj, func):
+    return Iterator(ref(call(func, item)) for item in iterate(obj))
+
+def lazy_filter(obj, func):
+    return Iterator(item for item in iterate(obj) if Bool(call(func, item)).val)
+
+def take(obj, n):
+    return Iterator(itertools.islice(iterate(obj), max(0, int(ref(n).val))))
+
+def skip(obj, n):
+    return Iterator(itertools.islice(iterate(obj), max(0, int(ref(n).val)), None))
+
+def zip_with(obj, other):
+    return Iterator(pair(a, b) for a, b in zip(iterate(obj), iterate(other)))
+
+def enumerate_items(obj):
+    return Iterator(pair(box(Number, float(i)), item) for i, item in enumerate(iterate(obj)))
+
+def collect(obj):
+    items = [item for item in iterate(obj)]
+    return List(type(items[0]) if items else Type, *items)
+
+adapters = {
+    'each':each,
+    'iter':stream,
+    'map':lazy_map,
+    'filter':lazy_filter,
+    'take':take,
+    'skip':skip,
+    'zip':zip_with,
+    'enumerate':enumerate_items,
+    'list':collect,
+}
 
 class Type():
+    __slots__ = ('val', 'attrs')
     typename = 'Type'
     def __init__(self):
         self.val = None
-        self.typename = 'Type'
-        self.attrs = {
-            '_set':Method(self.set),
-            '_get':Method(self.get),
-            '_eq':Method(self.eq),
-            '_string':Method(self.string),
-            '_type':Method(self.type),
-            '_cmp':Method(self.cmp),
-        }
+        self.attrs = empty
     def set(self, symbol, val):
         if symbol.val in self.attrs:
             if not isinstance(self.attrs[symbol.val], type(val)):
@@ -126,60 +260,67 @@ class Type():
             self.attrs[symbol.val] = val
         return val
     def get(self, symbol):
-        return self.attrs.get(symbol.val, null)
+        if symbol.val in self.attrs:
+            return self.attrs[symbol.val]
+        method = self.methods.get(symbol.val)
+        if method:
+            return Method(method.__get__(self))
+        return null
     def eq(self, new):
         typecheck(new, self.__class__, f'Invalid type for value')
-        self.val = new.val
-        self.attrs = new.attrs
+        for name in fields(type(self)):
+            setattr(self, name, getattr(new, name))
     def string(self):
         return String(f'<Type {self.__class__.__name__}>')
     def cmp(self, other):
         return Bool(self.val == other.val)
     def type(self):
         return 'Type'
+    methods = {
+        '_set':set,
+        '_get':get,
+        '_eq':eq,
+        '_string':string,
+        '_type':type,
+        '_cmp':cmp,
+    }
 
 class PyType(Type):
+    __slots__ = ()
     typename = '_PyType'
     def __init__(self, val):
         self.val = val
-        self.typename = '_PyType'
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_eq':Method(super().eq),
-        }
+        self.attrs = empty
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+    }
 
 class Method(Type):
+    __slots__ = ()
     typename = 'Method'
     def __init__(self, func):
         self.val = func
-        self.typename = 'Method'
-        self.attrs = {
-            '_call':self.val,
-            '_string':self.string,
-        }
+        self.attrs = empty
+    def call(self, *args):
+        return self.val(*args)
     def string(self):
         return String(f'<Method {id(self.val)}>')
+    methods = {
+        '_call':call,
+        '_string':string,
+    }
 
 class LazyMethod(Method):
-    pass
+    __slots__ = ()
 
 class String(Type):
+    __slots__ = ()
     typename = 'String'
     def __init__(self, val):
-        self.val = convert(val, '_string', lambda val: val.strip('"')).replace('\\r', '\r').replace('\\n', '\n')
-        self.typename = 'String'
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_string':Method(self.string),
-            '_type': Method(super().type()),
-            '_index': Method(self.index),
-            '_len': Method(self.len),
-            '_cmp':Method(super().cmp),
-            '_add':Method(self.add),
-            '_symbol':Method(lambda: Symbol(self.val)),
-        }
+        self.val = convert(val, '_string', str) # literals are unquoted once by the parser
+        self.attrs = empty
     def string(self):
         return self
     def index(self, index):
@@ -189,81 +330,155 @@ class String(Type):
     def len(self):
         return Number(len(self.val))
     def add(self, other):
-        return String(self.val + other.val)
-    def each(self, block, decl):
-        type, name = decl.val
-        for item in self.val:
-            block.val.globals.attrs[name] = String(item)
-            block.val.run()
+        return box(String, self.val + ref(other).val)
+    def symbol(self):
+        return Symbol(self.val)
+    def iter(self):
+        return (box(String, char) for char in self.val)
+    methods = {
+        **adapters,
+        '_set':Type.set,
+        '_get':Type.get,
+        '_string':string,
+        '_type':Type.type,
+        '_index':index,
+        '_len':len,
+        '_cmp':Type.cmp,
+        '_add':add,
+        '_symbol':symbol,
+        '_iter':iter,
+    }
+
+def text(val):
+    val = ref(val)
+    if type(val) is String:
+        return val.val
+    return call(get(val, '_string')).val
+
+def join(items, sep=None):
+    items = ref(items)
+    typecheck(items, List, f'Invalid type for join: expected List, got {items.typename}')
+    sep = '' if sep is None else text(sep)
+    if items.type is String:
+        return box(String, sep.join([item.val for item in items.val]))
+    return box(String, sep.join([text(item) for item in items.items()]))
+
+# collects pieces of text and joins them once in build, instead of a new String per +
+class StringBuilder(Type):
+    __slots__ = ()
+    typename = 'StringBuilder'
+    def __init__(self, *parts):
+        self.val = [text(part) for part in parts]
+        self.attrs = empty
+    def append(self, val):
+        self.val.append(text(val))
+    def append_line(self, val=None):
+        if val is not None:
+            self.val.append(text(val))
+        self.val.append('\n')
+    def build(self):
+        out = ''.join(self.val)
+        self.val[:] = [out] # later builds don't rejoin what is already joined
+        return box(String, out)
+    def clear(self):
+        self.val.clear()
+    def len(self):
+        return Number(sum(map(len, self.val)))
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+        '_string':build,
+        '_len':len,
+        'append':append,
+        'append_line':append_line,
+        'build':build,
+        'clear':clear,
+        'len':len,
+    }
+
+# a number on the left of a list works elementwise, anything else it can't take is an error
+def reflect(num, other, fn, symbol):
+    other = ref(other)
+    if isinstance(other, List):
+        return other.elementwise(num, lambda a, b: fn(b, a), symbol)
+    errors.error(f'Cannot {symbol} a number and {other.typename}')
 
 class Number(Type):
+    __slots__ = ()
     typename = 'Number'
     def __init__(self, val):
         self.val = convert(val, '_number', float)
-        self.typename = 'Number'
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_string':Method(self.string),
-            '_add':Method(self.add),
-            '_sub':Method(self.sub),
-            '_mul':Method(self.mul),
-            '_div':Method(self.div),
-            '_cmp':Method(super().cmp),
-            '_gt':Method(self.gt),
-            '_lt':Method(self.lt),
-            '_type':Method(super().type),
-        }
+        self.attrs = empty
     def string(self):
         return String(str(self.val))
     def add(self, other):
-        return Number(self.val + other.val)
+        try:
+            return Number(self.val + other.val)
+        except TypeError:
+            return reflect(self, other, operator.add, '+')
     def sub(self, other):
-        return Number(self.val - other.val)
+        try:
+            return Number(self.val - other.val)
+        except TypeError:
+            return reflect(self, other, operator.sub, '-')
     def mul(self, other):
-        return Number(self.val * other.val)
+        try:
+            return Number(self.val * other.val)
+        except TypeError:
+            return reflect(self, other, operator.mul, '*')
     def div(self, other):
-        return Number(self.val / other.val)
+        try:
+            return Number(self.val / other.val)
+        except TypeError:
+            return reflect(self, other, operator.truediv, '/')
     def gt(self, other):
         return Bool(self.val > other.val)
     def lt(self, other):
         return Bool(self.val < other.val)
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_string':string,
+        '_add':add,
+        '_sub':sub,
+        '_mul':mul,
+        '_div':div,
+        '_cmp':Type.cmp,
+        '_gt':gt,
+        '_lt':lt,
+        '_type':Type.type,
+    }
 
 class Symbol(Type):
+    __slots__ = ()
     typename = 'Symbol'
     def __init__(self, val):
-        self.val = convert(val, '_symbol', lambda val: String(val).val)
-        self.typename = 'Symbol'
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_string':Method(self.string),
-            '_type':Method(super().type),
-            '_add':Method(self.add),
-            '_cmp':Method(super().cmp),
-        }
+        self.val = convert(val, '_symbol', unquote)
+        self.attrs = empty
+    def __reduce__(self):
+        if symbols.get(self.val) is self:
+            return (intern, (self.val,))
+        return (Symbol, (self.val,))
     def string(self):
         return String(':' + self.val)
     def add(self, other):
         return Symbol(self.val + other.val)
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_string':string,
+        '_type':Type.type,
+        '_add':add,
+        '_cmp':Type.cmp,
+    }
 
 class Bool(Type):
+    __slots__ = ()
     typename = 'Bool'
     def __init__(self, val):
         self.val = convert(val, '_bool', bool)
-        self.typename = 'Bool'
-        self.attrs = {
-            '_set': Method(super().set),
-            '_get': Method(super().get),
-            '_string': Method(self.string),
-            '_number': Method(self.number),
-            '_type':Method(super().type),
-            '_add':Method(self.add),
-            '_sub':Method(self.sub),
-            '_mul':Method(self.mul),
-            '_cmp':Method(super().cmp),
-            '_div':Method(self.div),
-        }
+        self.attrs = empty
     def string(self):
         return String(str(self.val).lower())
     def number(self):
@@ -279,23 +494,33 @@ class Bool(Type):
         return Number(self.val * other.val)
     def div(self, other):
         return Number(self.val / other.val)
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_string':string,
+        '_number':number,
+        '_type':Type.type,
+        '_add':add,
+        '_sub':sub,
+        '_mul':mul,
+        '_cmp':Type.cmp,
+        '_div':div,
+    }
 
+# entries live in val keyed by their unboxed key, attrs only holds named attributes
 class Map(Type):
+    __slots__ = ('key_t', 'val_t')
     typename = 'Map'
-    def __init__(self, key_t, val_t):
-        self.key_t = key_t
-        self.val_t = val_t
+    layout = None # only scopes resolve names to slots
+    def __init__(self, key_t=None, val_t=None):
+        if isinstance(key_t, Reference):
+            key_t = get(key_t.to, '_call')()
+        if isinstance(val_t, Reference):
+            val_t = get(val_t.to, '_call')()
+        self.key_t = key_t or Type
+        self.val_t = val_t or Type
         self.val = {}
-        self.typename = 'Map'
-        self.attrs = {
-            '_set':Method(self.set),
-            '_get':Method(self.get),
-            '_string':Method(self.string),
-            '_cmp':Method(super().cmp),
-            '_type':Method(super().type),
-            '_index':Method(lambda val: self.get(Symbol(val))),
-            'each':Method(self.each),
-        }
+        self.attrs = {}
     def set(self, symbol, val):
         if symbol.val in self.attrs:
             typecheck(self.attrs[symbol.val], type(val), f'Invalid type for key {symbol.val}')
@@ -305,100 +530,321 @@ class Map(Type):
     def get(self, symbol):
         if symbol.val in self.attrs:
             return Reference(type(self.attrs[symbol.val]), self.attrs[symbol.val])
+        elif symbol.val in self.methods:
+            return Method(self.methods[symbol.val].__get__(self))
         else:
             return None
+    def key(self, val):
+        val = ref(val)
+        if self.key_t in (Symbol, String) and isinstance(val, (Symbol, String)):
+            return val.val # symbols and strings key the same entries
+        typecheck(val, self.key_t, f'Invalid type for map key: expected {self.key_t.typename}, got {val.typename}')
+        key = val.val if self.key_t in scalar else (type(val), val.val)
+        try:
+            hash(key)
+        except TypeError:
+            errors.error(f'Cannot use {val.typename} as a map key')
+        return key
+    def boxed(self, key):
+        if self.key_t is Symbol:
+            return intern(key)
+        elif self.key_t in scalar:
+            return box(self.key_t, key)
+        return box(*key)
+    def entry(self, key):
+        val = self.val.get(key)
+        if val is None:
+            errors.error(f'No such key {self.boxed(key).string().val}')
+        return val
+    def store(self, key, val):
+        val = ref(val)
+        typecheck(val, self.val_t, f'Invalid type for map value: expected {self.val_t.typename}, got {val.typename}')
+        self.val[key] = copy(val)
+    def lookup(self, key):
+        return self.entry(self.key(key))
+    def put(self, key, val):
+        self.store(self.key(key), val)
+    def has(self, key):
+        return Bool(self.key(key) in self.val)
+    def remove(self, key): # returns nothing, a value would end the block it is called in
+        key = self.key(key)
+        self.entry(key)
+        del self.val[key]
+    def update(self, other):
+        other = ref(other)
+        typecheck(other, Map, f'Invalid type for map update: expected Map, got {other.typename}')
+        if other.key_t is self.key_t and (self.val_t is Type or other.val_t is self.val_t):
+            # already keyed and checked the same way, the values are still copied in like store does
+            self.val.update({key: copy(val) for key, val in other.val.items()})
+            return
+        for key, val in other.val.items():
+            self.put(other.boxed(key), val)
+    def size(self):
+        return Number(len(self.val))
+    def keys(self):
+        return Iterator(map(self.boxed, list(self.val)))
+    def values(self):
+        return Iterator(iter(list(self.val.values())))
     def string(self):
         return String(f'<Map {self.key_t.typename}, {self.val_t.typename}>')
-    def each(self, block, decl):
-        type, name = decl.val
-        for item in self.attrs:
-            block.val.globals.attrs[name] = item
-            block.val.run()
+    def index(self, val):
+        return Entry(self, self.key(val))
+    def iter(self):
+        return map(self.boxed, list(self.val))
+    methods = {
+        **adapters,
+        '_set':set,
+        '_get':get,
+        '_string':string,
+        '_cmp':Type.cmp,
+        '_type':Type.type,
+        '_index':index,
+        '_iter':iter,
+        'get':lookup,
+        'set':put,
+        'has':has,
+        'remove':remove,
+        'update':update,
+        'size':size,
+        'keys':keys,
+        'values':values,
+    }
+
+class Scope(Map):
+    __slots__ = ('parent', 'layout', 'slots')
+    def __init__(self, layout=None, parent=None):
+        super().__init__(Symbol, Type)
+        self.parent = parent
+        self.adopt(layout)
+    def adopt(self, layout):
+        self.layout = layout
+        self.slots = [self.attrs.get(name) for name in layout.names] if layout else []
+    def cache(self, name):
+        if self.layout:
+            slot = self.layout.index.get(name)
+            if slot is not None:
+                self.slots[slot] = self.attrs[name]
+    def set(self, symbol, val):
+        Map.set(self, symbol, val)
+        self.cache(symbol.val)
+    def bind(self, name, val):
+        self.attrs[name] = val
+        self.cache(name)
+    def find(self, name):
+        return self.attrs.get(name)
+    def visible(self):
+        return self.attrs
+    def get(self, symbol):
+        if symbol.val in self.attrs or self.parent is None:
+            return Map.get(self, symbol)
+        val = self.parent.find(symbol.val)
+        if val is not None:
+            self.set(symbol, copy(val))
+            return Map.get(self, symbol)
+        else:
+            errors.error(f'No such local {symbol.val}')
+    def load(self, slot, symbol):
+        val = self.slots[slot]
+        if val is None:
+            return self.get(symbol)
+        return Reference(type(val), val)
+    def index(self, val):
+        return self.get(intern(convert(val, '_symbol', unquote)))
+    methods = { # names in a scope are variables, none of the map entry methods apply
+        '_set':set,
+        '_get':get,
+        '_string':Map.string,
+        '_cmp':Type.cmp,
+        '_type':Type.type,
+        '_index':index,
+    }
+
+# one call of a Func: its parameters and declarations, other names come from the body's scope
+class Frame(Scope):
+    __slots__ = ('captured',)
+    pool_size = 64
+    def __init__(self, layout, parent):
+        super().__init__(layout, parent)
+        self.captured = False
+    def find(self, name):
+        val = self.attrs.get(name)
+        if val is None:
+            return self.parent.attrs.get(name)
+        return val
+    def visible(self):
+        return collections.ChainMap(self.attrs, self.parent.attrs)
+    def get(self, symbol):
+        if symbol.val in self.attrs:
+            return Map.get(self, symbol)
+        return self.parent.get(symbol)
+    def load(self, slot, symbol):
+        val = self.slots[slot]
+        if val is None:
+            found = self.get(symbol)
+            if found is not None:
+                self.slots[slot] = ref(found)
+            return found
+        return Reference(type(val), val)
+    methods = {
+        **Scope.methods,
+        '_get':get,
+    }
+
+def acquire(layout, template):
+    if layout.frames:
+        frame = layout.frames.pop()
+        if frame.parent is not template:
+            frame.slots = [None] * len(frame.slots)
+            frame.parent = template
+        return frame
+    return Frame(layout, template)
+
+def release(frame):
+    frames = frame.layout.frames
+    if frame.captured or len(frames) >= Frame.pool_size:
+        return # a block made during the call still looks names up through it
+    slots = frame.slots
+    index = frame.layout.index
+    for name in frame.attrs:
+        slot = index.get(name)
+        if slot is not None:
+            slots[slot] = None # names found on the template stay cached for the next call
+    frame.attrs.clear()
+    frames.append(frame)
 
 class Reference(Type):
-    typename = 'Reference'
+    __slots__ = ('type', 'to')
     def __init__(self, type, to):
         self.type = type
         self.to = to # the thing this is a reference to
         self.val = to.val
-        self.attrs = self.to.attrs
-        self.attrs['_eq'] = Method(self.eq)
-        self.attrs['_addeq'] = Method(self.addeq)
-        self.attrs['_subeq'] = Method(self.subeq)
-        self.attrs['_muleq'] = Method(self.muleq)
-        self.attrs['_diveq'] = Method(self.diveq)
-        self.typename = to.typename
+        self.attrs = empty
+    @property
+    def typename(self):
+        return self.to.typename
+    def get(self, symbol):
+        if symbol.val in self.own:
+            return Method(self.own[symbol.val].__get__(self))
+        return get(self.to, symbol, error=False)
     def eq(self, val):
         if isinstance(val, Reference):
             val = val.to
         typecheck(val, self.type, f'Invalid type for reference')
         self.to.eq(val)
-        self.attrs.update(self.to.attrs)
         self.val = self.to.val
     def addeq(self, val):
         if isinstance(val, Reference):
             val = val.to
         typecheck(val, self.type, f'Invalid type for reference')
         self.to.eq(get(get(self.to, '_add'), '_call')(val))
-        self.attrs.update(self.to.attrs)
         self.val = self.to.val
     def subeq(self, val):
         if isinstance(val, Reference):
             val = val.to
         typecheck(val, self.type, f'Invalid type for reference')
         self.to.eq(get(get(self.to, '_sub'), '_call')(val))
-        self.attrs.update(self.to.attrs)
         self.val = self.to.val
     def muleq(self, val):
         if isinstance(val, Reference):
             val = val.to
         typecheck(val, self.type, f'Invalid type for reference')
         self.to.eq(get(get(self.to, '_mul'), '_call')(val))
-        self.attrs.update(self.to.attrs)
         self.val = self.to.val
     def diveq(self, val):
         if isinstance(val, Reference):
             val = val.to
         typecheck(val, self.type, f'Invalid type for reference')
         self.to.eq(get(get(self.to, '_div'), '_call')(val))
-        self.attrs.update(self.to.attrs)
         self.val = self.to.val
     def string(self):
         return self.to.string()
+    own = {
+        '_eq':eq,
+        '_addeq':addeq,
+        '_subeq':subeq,
+        '_muleq':muleq,
+        '_diveq':diveq,
+    }
+    methods = {**own, '_get':get} # everything else is looked up on the target
+
+# m[key], assigning through it stores into the map, even when the key is new
+class Entry(Reference):
+    __slots__ = ('map', 'key')
+    def __init__(self, map, key):
+        self.type = map.val_t
+        self.map = map
+        self.key = key
+        val = map.val.get(key)
+        self.val = None if val is None else val.val
+        self.attrs = empty
+    @property
+    def to(self):
+        return self.map.entry(self.key) # reports a missing key wherever the value is needed
+    def get(self, symbol):
+        if self.key not in self.map.val and symbol.val not in self.own and '_' + symbol.val in self.own:
+            return # op() asks for eq before _eq
+        return Reference.get(self, symbol)
+    def eq(self, val):
+        self.map.store(self.key, val)
+        self.val = self.map.val[self.key].val
+    own = {**Reference.own, '_eq':eq}
+    methods = {**own, '_get':get}
 
 class Block(Type):
+    __slots__ = ('parent', 'scope')
     typename = 'Block'
     def __init__(self, ast, scope=None):
         self.val = ast
         self.parent = scope
         self.scope = ast.globals
-        self.typename = 'Block'
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_eq':Method(super().eq),
-            '_call':Method(self.val.run),
-            '_string':Method(self.string),
-        }
-        self.val.globals.attrs['_get'] = Method(self.get)
+        self.attrs = empty
+        if self.scope is not scope:
+            self.scope.parent = scope
+            if isinstance(scope, Frame):
+                scope.captured = True
+    def call(self):
+        return self.val.run()
     def string(self):
         return String(repr(self.val))
-    def get(self, attr):
-        if attr.val in self.scope.attrs:
-            return self.scope.get(attr)
-        elif attr.val in self.parent.attrs:
-            val = self.parent.get(attr).to
-            self.scope.set(attr, copy(val))
-            return self.scope.get(attr)
-        else:
-            errors.error(f'No such local {attr.val}')
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+        '_call':call,
+        '_string':string,
+    }
+
+# "math.sin", "str.upper" or "print": the longest importable prefix is the module, the rest are attributes
+def resolve_python(path):
+    parts = path.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            out = importlib.import_module('.'.join(parts[:i]))
+            break
+        except ImportError:
+            continue
+    else:
+        out, i = builtins, 0
+    try:
+        for part in parts[i:]:
+            out = getattr(out, part)
+    except AttributeError as e:
+        errors.error(f'Cannot bind {path}: {e}')
+    return out
+
+def param_type(scope, name):
+    if '.' in name: # a type exported by a module, like socket.conn
+        return get_name(scope, name).val()
+    return scope.get(intern(name)).val()
 
 class Func(Type):
+    __slots__ = ('params', 'res', 'types')
     typename = 'Func'
     def __init__(self, scope, block, *params):
         self.val = block
         self.params = params[:-1] # what is expected
-        self.typename = 'Func'
+        self.attrs = empty
+        self.types = None # parameter types of an extern, resolved when it is bound
         if not params:
             self.res = Type
         else:
@@ -411,56 +857,212 @@ class Func(Type):
                     self.res = self.res()
             else:
                 self.res = type(last)
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_eq':Method(super().eq),
-            '_call':Method(self.call),
-        }
-    def call(self, *args):
+    @classmethod
+    def extern(cls, scope, target, *params):
+        target = ref(target)
+        if isinstance(target, String):
+            target = resolve_python(target.val)
+        elif isinstance(target, PyType):
+            target = target.val
+        if not callable(target):
+            errors.error(f'Cannot bind {target!r}, it is not callable')
+        out = cls(scope, target, *params)
+        out.types = [param_type(scope, param.val[0]) for param in out.params]
+        return out
+    def invoke(self, args):
+        if len(args) != len(self.types):
+            errors.error('Wrong amount of arguments')
+            return
+        vals = []
+        for arg, t in zip(args, self.types):
+            arg = ref(arg)
+            if not typecheck(arg, t, f'Invalid argument type: expected {t.typename}, got {arg.typename}'):
+                return
+            vals.append(arg.val if type(arg) in scalar or type(arg) is PyType else arg)
+        out = self.val(*vals)
+        if self.res is type(None):
+            return
+        elif self.res is Symbol:
+            return intern(str(out))
+        elif self.res in scalar:
+            return box(self.res, unboxed[self.res](out))
+        elif isinstance(out, Type):
+            self.check(out)
+            return out
+        return PyType(out)
+    def enter(self, args):
         args = list(args)
         if len(args) != len(self.params):
             errors.error('Wrong amount of arguments')
             return
+        template = self.val.scope
+        frame = acquire(self.val.val.ast.layout, template)
         for i in range(len(self.params)):
             param = self.params[i]
             name = param.val[1]
-            t = self.val.scope.get(Symbol(param.val[0])).val()
+            t = param_type(template, param.val[0])
             if isinstance(args[i], Reference):
                 args[i] = args[i].to
             if not typecheck(args[i], t, f'Invalid argument type: expected {t.typename}, got {args[i].typename}'):
+                release(frame)
                 return
-            self.val.scope.set(Symbol(name), args[i])
-        out = self.val.val.run()
-        if isinstance(out, Reference):
-            out = out.to
+            frame.set(intern(name), args[i])
+        return frame
+    def check(self, out):
         if type(out) != Type:
             if self.res == type(None):
                 if out:
                     errors.error(f'Expected no return value, got {out.typename}')
             else:
                 typecheck(out, self.res, f'Invalid return type: expected {self.res.typename}, got {out.typename}')
+    def call(self, *args):
+        if self.types is not None:
+            return self.invoke(args)
+        func = self
+        chain = [self]
+        while True:
+            frame = func.enter(args)
+            if frame is None:
+                return
+            program = func.val.val
+            outer = program.globals
+            program.globals = frame
+            try:
+                out = program.run()
+            finally:
+                program.globals = outer
+                release(frame)
+            if not isinstance(out, TailCall):
+                break
+            func, args = out.func, out.args # run the tail call in place of this one
+            if not any(prev.res is func.res for prev in chain):
+                chain.append(func)
+        if isinstance(out, Reference):
+            out = out.to
+        for func in reversed(chain):
+            func.check(out)
         return out
     def Return(val):
         pass
+    methods = {
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+        '_call':call,
+    }
+
+class TailCall():
+    __slots__ = ('func', 'args')
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+def tail(obj, *args):
+    func = ref(obj)
+    if isinstance(func, Func) and func.types is None and func.res is not type(None):
+        return TailCall(func, args) # handed back up to the Func.call that is returning it
+    return call(obj, *args)
+
+# least recently used results of a memoised func, shared by every copy of the Memo
+class Results():
+    def __init__(self, max):
+        self.entries = collections.OrderedDict()
+        self.max = max
+        self.hits = 0
+        self.misses = 0
+    def find(self, key):
+        out = self.entries.get(key)
+        if out is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return out
+    def store(self, key, out):
+        self.entries[key] = out
+        if len(self.entries) > self.max:
+            self.entries.popitem(last=False)
+
+def memo_key(args):
+    key = []
+    for arg in args:
+        arg = ref(arg)
+        if type(arg) in (Number, String, Bool, Symbol):
+            key.append((type(arg), arg.val))
+        elif isinstance(arg, List):
+            if type(arg.val) is list:
+                items = memo_key(arg.val)
+                if items is None:
+                    return
+            else:
+                items = tuple(arg.val)
+            key.append((List, arg.type, items))
+        else:
+            return # no stable value to key on
+    return tuple(key)
+
+class Memo(Type):
+    __slots__ = ('results',)
+    typename = 'Memo'
+    def __init__(self, func, max=None):
+        func = ref(func)
+        typecheck(func, Func, f'Invalid type for memo: expected Func, got {func.typename}')
+        if max is None:
+            max = Number(128)
+        max = ref(max)
+        typecheck(max, Number, f'Invalid type for memo size: expected number, got {max.typename}')
+        self.val = func
+        self.results = Results(max.val)
+        self.attrs = empty
+    def call(self, *args):
+        key = memo_key(args)
+        if key is None:
+            self.results.misses += 1
+            return self.val.call(*args)
+        out = self.results.find(key)
+        if out is not None:
+            return copy(out)
+        out = self.val.call(*args)
+        if out is not None:
+            self.results.store(key, copy(out))
+        return out
+    def get(self, symbol):
+        if symbol.val == 'hits':
+            return Number(self.results.hits)
+        elif symbol.val == 'misses':
+            return Number(self.results.misses)
+        elif symbol.val == 'size':
+            return Number(len(self.results.entries))
+        elif symbol.val == 'max':
+            return Number(self.results.max)
+        return Type.get(self, symbol)
+    def clear(self):
+        self.results.entries.clear()
+        self.results.hits = 0
+        self.results.misses = 0
+    def string(self):
+        return String(f'<Memo {len(self.results.entries)}/{self.results.max:g} hits {self.results.hits} misses {self.results.misses}>')
+    methods = {
+        '_set':Type.set,
+        '_get':get,
+        '_eq':Type.eq,
+        '_call':call,
+        '_string':string,
+        'clear':clear,
+    }
 
 class Class(Type):
+    __slots__ = ()
+    typename = 'Class'
     def __init__(self, block):
         self.val = block
-        self.typename = 'Class'
-        self.attrs = {
-            '_set': Method(self.set),
-            '_get': Method(self.get),
-            '_call':Method(self.call),
-            '_eq':Method(super().eq),
-            '_string':Method(self.string),
-        }
+        self.attrs = empty
     def set(self, symbol, val):
         self.val.val.globals.set(symbol, val)
     def get(self, symbol):
         if symbol.val in self.val.val.globals.attrs:
             return self.val.val.globals.get(symbol)
-        return self.attrs.get(symbol.val, null)
+        return Type.get(self, symbol)
     def call(self):
         new = Class(self.val)
         new.attrs = self.attrs
@@ -469,36 +1071,72 @@ class Class(Type):
         return new
     def string(self):
         return String(f'<Class {id(self.val)}>')
+    methods = {
+        '_set':set,
+        '_get':get,
+        '_call':call,
+        '_eq':Type.eq,
+        '_string':string,
+    }
 
 
+# number and bool lists keep their items unboxed in an array, boxed on the way out
 class List(Type):
+    __slots__ = ('type',)
+    typename = 'List'
     def __init__(self, type, *args):
         if isinstance(type, Reference):
             type = get(type.to, '_call')()
+        args = [ref(arg) for arg in args]
         for arg in args:
             typecheck(arg, type, f'Invalid type for list item: expected {type.typename}, got {arg.typename}')
-        self.val = list(args)
+        code = packed.get(type)
+        if code:
+            self.val = array.array(code, [arg.val for arg in args])
+        else:
+            self.val = args
         self.type = type
-        self.typename = 'List'
-        self.attrs = {
-            '_get':Method(super().get),
-            '_set':Method(super().set),
-            '_string':Method(self.string),
-            'append':Method(self.val.append),
-            '_type':Method(lambda: String('List')),
-            '_index':Method(self.index),
-            'each':Method(self.each),
-            'sort': Method(self.sort),
-        }
+        self.attrs = empty
+    @classmethod
+    def wrap(cls, type, vals):
+        out = object.__new__(cls) # vals are already unboxed and of the right type
+        code = packed.get(type)
+        out.val = array.array(code, vals) if code else list(vals)
+        out.type = type
+        out.attrs = empty
+        return out
+    def boxed(self, item):
+        return box(self.type, bool(item) if self.type is Bool else item)
+    def items(self):
+        if type(self.val) is list:
+            return self.val
+        return [self.boxed(item) for item in self.val]
+    def clone(self):
+        out = object.__new__(List)
+        out.val = self.val[:]
+        out.type = self.type
+        out.attrs = empty
+        return out
     def append(self, val):
-        typecheck(val, self.type, f'Invalid type for list item: expected {self.type.typename}, got {val.typename}')
-        self.val.append(val)
+        val = ref(val)
+        if type(val) is not self.type:
+            typecheck(val, self.type, f'Invalid type for list item: expected {self.type.typename}, got {val.typename}')
+        if type(self.val) is list:
+            self.val.append(val)
+        else:
+            self.val.append(val.val)
     def string(self):
+        if type(self.val) is not list:
+            if self.type is Bool:
+                return String('[' + ', '.join('true' if item else 'false' for item in self.val) + ']')
+            return String('[' + ', '.join(map(str, self.val)) + ']')
         out = '['
         for item in self.val:
             out += item.string().val + ', '
         out = out.rstrip(', ') + ']'
         return String(out)
+    def type_name(self):
+        return String('List')
     def index(self, val):
         if isinstance(val, Reference):
             val = val.to
@@ -508,33 +1146,230 @@ class List(Type):
         if val.val > len(self.val) - 1 or not self.val:
             errors.error('Index too high')
             return
-        return Reference(self.type, self.val[int(val.val)])
+        if type(self.val) is list:
+            return Reference(self.type, self.val[int(val.val)])
+        return Element(self, int(val.val))
     def sort(self):
-        self.val = sorted(self.val)
-    def each(self, block, decl):
-        type, name = decl.val
-        for item in self.val:
-            block.val.globals.attrs[name] = item
-            block.val.run()
+        if type(self.val) is list:
+            self.val = sorted(self.val, key=lambda item: item.val)
+        else:
+            self.val = array.array(self.val.typecode, sorted(self.val))
+    def iter(self):
+        if type(self.val) is list:
+            return iter(self.val)
+        return map(self.boxed, self.val)
+    def numbers(self, name):
+        if self.type is not Number:
+            errors.error(f'{name} needs a list(number), got a list({self.type.typename})')
+        return self.val
+    def sum(self):
+        return Number(math.fsum(self.numbers('sum')))
+    def mean(self):
+        vals = self.numbers('mean')
+        if not vals:
+            errors.error('mean of an empty list')
+            return
+        return Number(math.fsum(vals) / len(vals))
+    def min(self):
+        if not self.val:
+            errors.error('min of an empty list')
+            return
+        if type(self.val) is list:
+            return min(self.val, key=lambda item: item.val)
+        return self.boxed(min(self.val))
+    def max(self):
+        if not self.val:
+            errors.error('max of an empty list')
+            return
+        if type(self.val) is list:
+            return max(self.val, key=lambda item: item.val)
+        return self.boxed(max(self.val))
+    def map(self, func):
+        out = [ref(call(func, item)) for item in self.items()]
+        return List(type(out[0]) if out else self.type, *out)
+    def filter(self, func):
+        if type(self.val) is list:
+            return List.wrap(self.type, [item for item in self.val if Bool(call(func, item)).val])
+        return List.wrap(self.type, [item for item in self.val if Bool(call(func, self.boxed(item))).val])
+    def reduce(self, func, *start):
+        items = self.items()
+        if start:
+            out = start[0]
+        elif items:
+            out, items = items[0], items[1:]
+        else:
+            errors.error('reduce of an empty list with no start value')
+            return
+        for item in items:
+            out = call(func, out, item)
+        return out
+    # elementwise arithmetic between two list(number)s of the same length, or a list(number) and a number
+    def elementwise(self, other, fn, symbol):
+        vals = self.numbers(symbol)
+        other = ref(other)
+        try:
+            if isinstance(other, List):
+                others = other.numbers(symbol)
+                if len(others) != len(vals):
+                    errors.error(f'Cannot {symbol} lists of length {len(vals)} and {len(others)}')
+                    return
+                return List.wrap(Number, map(fn, vals, others))
+            elif isinstance(other, Number):
+                return List.wrap(Number, map(fn, vals, itertools.repeat(other.val, len(vals))))
+        except ZeroDivisionError:
+            errors.error('Division by zero')
+            return
+        errors.error(f'Cannot {symbol} a list and {other.typename}')
+    def add(self, other):
+        return self.elementwise(other, operator.add, '+')
+    def sub(self, other):
+        return self.elementwise(other, operator.sub, '-')
+    def mul(self, other):
+        return self.elementwise(other, operator.mul, '*')
+    def div(self, other):
+        return self.elementwise(other, operator.truediv, '/')
+    methods = {
+        **adapters,
+        '_get':Type.get,
+        '_set':Type.set,
+        '_string':string,
+        '_iter':iter,
+        'append':append,
+        '_type':type_name,
+        '_index':index,
+        '_add':add,
+        '_sub':sub,
+        '_mul':mul,
+        '_div':div,
+        'sort':sort,
+        'sum':sum,
+        'mean':mean,
+        'min':min,
+        'max':max,
+        'map':map,
+        'filter':filter,
+        'reduce':reduce,
+    }
+
+# an item boxed out of a packed List, assigning through it writes back to the list
+class Element(Reference):
+    __slots__ = ('list', 'index')
+    def __init__(self, list, index):
+        self.type = list.type
+        self.to = list.boxed(list.val[index])
+        self.val = self.to.val
+        self.attrs = empty
+        self.list = list
+        self.index = index
+    def store(self):
+        self.list.val[self.index] = self.to.val
+    def eq(self, val):
+        Reference.eq(self, val)
+        self.store()
+    def addeq(self, val):
+        Reference.addeq(self, val)
+        self.store()
+    def subeq(self, val):
+        Reference.subeq(self, val)
+        self.store()
+    def muleq(self, val):
+        Reference.muleq(self, val)
+        self.store()
+    def diveq(self, val):
+        Reference.diveq(self, val)
+        self.store()
+    own = {
+        '_eq':eq,
+        '_addeq':addeq,
+        '_subeq':subeq,
+        '_muleq':muleq,
+        '_diveq':diveq,
+    }
+    methods = {**own, '_get':Reference.get}
 
 class Range(Type):
-    def __init__(self, end, start=Number(0), inc=Number(1)):
+    __slots__ = ('end', 'inc')
+    typename = 'Range'
+    def __init__(self, end, start=None, inc=None):
         end = ref(end)
         typecheck(end, Number, f'Invalid type for range end: expected number, got {end.typename}')
-        self.typename = 'Range'
+        start = Number(0) if start is None else ref(start)
+        inc = Number(1) if inc is None else ref(inc)
+        typecheck(start, Number, f'Invalid type for range start: expected number, got {start.typename}')
+        typecheck(inc, Number, f'Invalid type for range step: expected number, got {inc.typename}')
+        if inc.val == 0:
+            errors.error('Range step cannot be 0')
         self.val = start
         self.end = end
         self.inc = inc
+        self.attrs = empty
+    def iter(self):
+        start, end, inc = self.val.val, self.end.val, self.inc.val
+        steps = (end - start) / inc
+        if steps == math.inf:
+            counter = itertools.count()
+        elif steps > 0:
+            counter = range(math.ceil(steps))
+        else:
+            counter = ()
+        return (box(Number, start + i * inc) for i in counter)
+    def string(self):
+        return String(f'<Range {self.val.val:g} to {self.end.val:g} by {self.inc.val:g}>')
+    methods = {
+        **adapters,
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+        '_string':string,
+        '_iter':iter,
+    }
+
+# a lazy stream of values, used up by the first thing that runs through it
+class Iterator(Type):
+    __slots__ = ()
+    typename = 'Iterator'
+    def __init__(self, items):
+        self.val = items
+        self.attrs = empty
+    def iter(self):
+        return self.val
+    def string(self):
+        return String('<Iterator>')
+    methods = {
+        **adapters,
+        '_set':Type.set,
+        '_get':Type.get,
+        '_eq':Type.eq,
+        '_string':string,
+        '_iter':iter,
+    }
+
+op_symbols = {op: [(intern(name), intern('_' + name)) for name in names] for op, names in op_names.items()}
+
+# what op() and call() would find for an operator on a plain value of a type, so the vm can
+# call it directly. None where it depends on the value and has to be looked up every time
+binaries = {} # (type, operator symbol) -> method taking (value, other)
+assignments = {} # (type, operator symbol) -> method of a Reference to a value of that type
+
+def binary(cls, symbol):
+    methods = getattr(cls, 'methods', None)
+    out = None
+    if methods is not None and methods.get('_get') is Type.get and symbol.val in op_symbols:
+        name, private = op_symbols[symbol.val][0]
+        out = methods.get(name.val) or methods.get(private.val)
+    binaries[(cls, symbol)] = out
+    return out
+
+def assignment(cls, symbol):
+    methods = getattr(cls, 'methods', None)
+    out = None
+    if methods is not None and methods.get('_get') is Type.get and symbol.val in op_symbols:
+        name, private = op_symbols[symbol.val][0]
+        if name.val not in methods:
+            out = Reference.own.get(private.val)
+    assignments[(cls, symbol)] = out
+    return out
 
-        self.attrs = {
-            '_set':Method(super().set),
-            '_get':Method(super().get),
-            '_eq':Method(super().eq),
-            'each':Method(self.each),
-        }
-    def each(self, block, decl):
-        type, name = decl.val
-        while self.val.lt(self.end).val:
-            block.val.globals.attrs[name] = Number(self.val.val)
-            block.val.run()
-            self.val.val += self.inc.val
+scalar = (Number, String, Symbol, Bool) # map keys stored as their bare value
+unboxed = {Number:float, String:str, Bool:bool}
+packed = {Number:'d', Bool:'b'} # list item types kept unboxed, with their array typecodes
@@ -0,0 +1,121 @@
+import data
+import errors
+import math
+import os
+import sys
+
+# Workers are forked at the call, so each one starts from a copy of the program as it
+# is right then: its globals, imported modules and the func itself. Nothing a worker
+# changes comes back to the caller or reaches the other workers, only return values do.
+
+job = None # (call, items) for the workers forked by the running call
+chunks_per_worker = 4
+
+def cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def fork():
+    import multiprocessing # only paid for by scripts that use it
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+# results cross the process boundary as plain python values
+def pack(val):
+    val = data.ref(val)
+    t = type(val)
+    if val is None:
+        return None
+    elif t is data.Symbol:
+        return (t, val.val)
+    elif t in data.scalar:
+        return (t, val.val)
+    elif t is data.List:
+        return (t, val.type, [pack(item) for item in val.items()])
+    elif t is data.Map:
+        return (t, val.key_t, val.val_t, [(pack(val.boxed(key)), pack(item)) for key, item in val.val.items()])
+    errors.error(f'Workers can only return numbers, strings, bools, symbols, lists and maps, got {val.typename}')
+
+def unpack(val):
+    if val is None:
+        return None
+    t = val[0]
+    if t is data.Symbol:
+        return data.intern(val[1])
+    elif t in data.scalar:
+        return data.box(t, val[1])
+    elif t is data.List:
+        return data.List(val[1], *[unpack(item) for item in val[2]])
+    out = data.Map(val[1], val[2])
+    for key, item in val[3]:
+        out.put(unpack(key), unpack(item))
+    return out
+
+def work(bounds):
+    call, items = job
+    try:
+        out = [pack(call(items[i])) for i in range(*bounds)]
+    except SystemExit: # the error is already printed
+        out = None
+    except Exception as e:
+        print(f'\033[0;31mError: Python threw error: {type(e).__name__} {e}\033[0;0m', file=sys.stderr)
+        out = None
+    sys.stdout.flush() # workers leave without flushing
+    return out
+
+def run(call, obj, workers, name):
+    global job
+    obj = data.ref(obj)
+    if isinstance(obj, data.Range) and (obj.end.val - obj.val.val) / obj.inc.val == math.inf:
+        errors.error(f'Cannot {name} over an infinite range')
+    items = list(data.iterate(obj))
+    workers = min(workers or cores(), len(items))
+    context = fork()
+    if workers < 2 or context is None:
+        return [call(item) for item in items]
+    size = math.ceil(len(items) / (workers * chunks_per_worker))
+    bounds = [(start, min(start + size, len(items))) for start in range(0, len(items), size)]
+    sys.stdout.flush()
+    sys.stderr.flush()
+    job = (call, items)
+    out = []
+    try:
+        with context.Pool(workers) as pool: # leaving stops whatever is still running
+            for chunk in pool.imap(work, bounds):
+                if chunk is None:
+                    errors.error(f'{name} stopped, a worker failed')
+                    return []
+                out.extend(unpack(val) for val in chunk)
+    finally:
+        job = None
+    return out
+
+def count(args, name):
+    if len(args) == 3:
+        workers = data.ref(args[2])
+        data.typecheck(workers, data.Number, f'{name} needs a number of workers, got {workers.typename}')
+        return int(workers.val)
+
+# pmap(items, f) or pmap(items, f, workers)
+def pmap(*args):
+    if not 2 <= len(args) <= 3:
+        errors.error(f'pmap needs items, a func and optionally a number of workers, got {len(args)} arguments')
+    func = args[1]
+    out = run(lambda item: data.ref(data.call(func, item)), args[0], count(args, 'pmap'), 'pmap')
+    if not out:
+        return data.List(data.Type)
+    if any(val is None for val in out):
+        errors.error('pmap needs a func that returns a value')
+    return data.List(type(out[0]), *out)
+
+# parallel_each(items, number: i) { ... } or parallel_each(items, number: i, workers) { ... }
+def parallel_each(*args):
+    if not 3 <= len(args) <= 4:
+        errors.error(f'parallel_each needs items, a loop variable and a block, and optionally a number of workers, got {len(args) - 1} arguments')
+    block, args = args[0], args[1:]
+    name = args[1].val[1]
+    def call(item):
+        block.val.globals.bind(name, item)
+        block.val.run()
+    run(call, args[0], count(args, 'parallel_each'), 'parallel_each')
@@ -1,12 +1,33 @@
 import sly
 import errors
+import data
+import marshal
+import os
+import os.path
+import time
+import types
+
+# the LALR tables sly builds for Parser are stored here and reused while the grammar is unchanged
+tables = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__qylcache__', 'parser.tables')
+table_time = 0.0 # spent building or loading them, for --startup-stats
+tables_cached = False
+
+def path(name):
+    return tuple(data.intern(part) for part in name.split('.'))
 
 class Node():
-    def __init__(self, type, *val):
+    file = '<input>' # set on program nodes loaded from a file
+    func = None # (name, file, line) on the bodies of funcs
+    def __init__(self, type, *val, line=None):
         self.type = type
         self.val = list(val)
+        self.line = line # of the first token, set by the parser
     def __repr__(self):
         return self.string(0).rstrip('\n')
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('code', None) # compiled bytecode is rebuilt on demand
+        return state
     def string(self, n):
         out = f'{"    " * n}{self.type}\n'
         for value in self.val:
@@ -22,61 +43,147 @@ class Lexer(sly.Lexer):
     ignore_comment = r'#.*?'
     literals = { "(", ")", "{", "}", ",", ".", ":", "[", "]"}
 
-    NEWLINE = r'\n'
-    STRING = r'".*?"'
+    STRING = r'"(\\.|[^"\\\n])*"'
     BOOL = r'(true|false)'
     NUMBER = r'-?[0-9]+(\.[0-9]+)?'
     SYMBOL = r':[^ \t\n(){}".,:\]\[]+(\.[^ \t\n(){}".:,+\]\[]+)*'
     NAME = r'[^ \t\n(){}".,:\]\[]+(\.[^ \t\n(){}".,:+\]\[]+)*' # here
 
+    @_(r'\n')
+    def NEWLINE(self, t):
+        self.lineno += 1
+        return t
+
     def error(self, t):
-        errors.error('Syntax error')
+        errors.error(f'Syntax error on line {self.lineno}')
+
+def rule_funcs(definitions):
+    out = []
+    for name, value in definitions:
+        while callable(value) and hasattr(value, 'rules'):
+            out.append(value)
+            value = getattr(value, 'next_func', None) # earlier rules of the same name
+    return out
+
+def grammar_key(cls, funcs):
+    return repr((sly.__version__, sorted(cls.tokens), getattr(cls, 'precedence', None), getattr(cls, 'start', None),
+        [(func.__name__, func.rules) for func in funcs]))
+
+def load_tables(cls, funcs, key):
+    try:
+        with open(tables, 'rb') as f:
+            saved = marshal.load(f)
+    except (OSError, ValueError, EOFError, TypeError):
+        return False
+    if not isinstance(saved, dict) or saved.get('key') != key:
+        return False
+    try:
+        productions = [sly.yacc.Production(number, name, prod, prec, None if func is None else funcs[func], '', line)
+            for number, (name, prod, prec, func, line) in enumerate(saved['productions'])]
+    except (TypeError, IndexError): # saved by a sly whose Production we don't match, rebuild
+        return False
+    cls._grammar = types.SimpleNamespace(Productions=productions)
+    cls._lrtable = types.SimpleNamespace(lr_action=saved['action'], lr_goto=saved['goto'], defaulted_states=saved['defaulted'])
+    return True
+
+def store_tables(cls, funcs, key):
+    index = {id(func):i for i, func in enumerate(funcs)}
+    saved = {
+        'key':key,
+        'productions':[(p.name, p.prod, p.prec, None if p.func is None else index[id(p.func)], p.line) for p in cls._grammar.Productions],
+        'action':cls._lrtable.lr_action,
+        'goto':cls._lrtable.lr_goto,
+        'defaulted':cls._lrtable.defaulted_states,
+    }
+    try:
+        os.makedirs(os.path.dirname(tables), exist_ok=True)
+        tmp = f'{tables}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump(saved, f)
+        os.replace(tmp, tables)
+    except OSError:
+        pass
+
+# the private steps of sly.Parser._build replayed on a cache miss
+steps = ('_Parser__validate_specification', '_Parser__build_grammar', '_Parser__build_lrtables')
 
 class Parser(sly.Parser):
     tokens = Lexer.tokens
 
-    def error(self, t):
-        errors.error('Syntax error')
+    @classmethod
+    def _build(cls, definitions):
+        global table_time, tables_cached
+        start = time.perf_counter()
+        if not all(hasattr(sly.Parser, step) for step in steps):
+            del cls._build # sly skips classes defining their own, so build uncached its way
+            cls._build(definitions)
+        else:
+            funcs = rule_funcs(definitions)
+            key = grammar_key(cls, funcs)
+            tables_cached = load_tables(cls, funcs, key)
+            if not tables_cached:
+                if not cls._Parser__validate_specification():
+                    raise sly.yacc.YaccError('Invalid parser specification')
+                cls._Parser__build_grammar([(name, value) for name, value in definitions if callable(value) and hasattr(value, 'rules')])
+                if not cls._Parser__build_lrtables():
+                    raise sly.yacc.YaccError('Can\'t build parsing tables')
+                store_tables(cls, funcs, key)
+        table_time = time.perf_counter() - start
 
-    @_('')
-    def program(self, t):
-        return Node('program')
+    def error(self, t):
+        errors.error(f'Syntax error on line {t.lineno}' if t else 'Syntax error at end of file')
 
+    # programs and lists grow from the left, appending to the node built so far, so a
+    # long file or array literal is parsed in linear time
     @_('statement')
     def program(self, t):
-        return Node('program', t.statement)
+        return Node('program') if t.statement is None else Node('program', t.statement)
 
-    @_('program NEWLINE program')
+    @_('program NEWLINE statement')
     def program(self, t):
-        return Node('program', *t.program0.val, *t.program1.val)
+        if t.statement is not None:
+            t.program.val.append(t.statement)
+        return t.program
 
     @_('"[" list "]"')
     def expr(self, t):
-        return Node('array', t.list) # stop don't change that
+        return Node('array', t.list, line=t.lineno) # stop don't change that
 
     @_('expr "(" list ")"')
     def expr(self, t):
-        return Node('call', t.expr, t.list)
+        return Node('call', t.expr, t.list, line=t.lineno)
 
     @_('NAME ":" NAME')
     def expr(self, t):
-        return Node('decl', t.NAME0, t.NAME1)
+        node = Node('decl', t.NAME0, t.NAME1, line=t.lineno)
+        node.symbols = path(t.NAME0)
+        node.symbol = data.intern(t.NAME1)
+        return node
 
     @_('NAME ":" NAME "(" list ")"')
     def expr(self, t):
-        return Node('decl', t.NAME0, t.NAME1, t.list)
+        node = Node('decl', t.NAME0, t.NAME1, t.list, line=t.lineno)
+        node.symbols = path(t.NAME0)
+        node.symbol = data.intern(t.NAME1)
+        return node
 
     @_('expr "(" list ")" "{" program "}"')
     def expr(self, t):
-        return Node('call', t.expr, Node('list', Node('block', t.program), *t.list.val))
+        return Node('call', t.expr, Node('list', Node('block', t.program), *t.list.val), line=t.lineno)
 
     @_('expr NAME expr')
     def expr(self, t):
-        return Node('op', t.expr0, t.NAME, t.expr1)
+        node = Node('op', t.expr0, t.NAME, t.expr1, line=t.lineno)
+        node.symbol = data.intern(t.NAME)
+        return node
 
     @_('expr "[" expr "]"')
     def expr(self, t):
-        return Node('index', t.expr0, t.expr1)
+        return Node('index', t.expr0, t.expr1, line=t.lineno)
+
+    @_('')
+    def statement(self, t):
+        return None
 
     @_('expr')
     def statement(self, t):
@@ -84,40 +191,50 @@ class Parser(sly.Parser):
 
     @_('BOOL')
     def expr(self, t):
-        return Node('bool', t.BOOL)
+        return Node('bool', t.BOOL, line=t.lineno)
 
-    @_('')
+    @_('item')
     def list(self, t):
-        return Node('list')
+        return Node('list') if t.item is None else Node('list', t.item)
 
-    @_('expr')
+    @_('list "," item')
     def list(self, t):
-        return Node('list', t.expr)
+        if t.item is not None:
+            t.list.val.append(t.item)
+        return t.list
 
-    @_('list "," list')
-    def list(self, t):
-        return Node('list', *t.list0.val, *t.list1.val)
+    @_('')
+    def item(self, t):
+        return None
+
+    @_('expr')
+    def item(self, t):
+        return t.expr
 
     @_('"{" program "}"')
     def expr(self, t):
-        return Node('block', t.program)
+        return Node('block', t.program, line=t.lineno)
 
     @_('NAME')
     def expr(self, t):
-        return Node('name', t.NAME)
+        node = Node('name', t.NAME, line=t.lineno)
+        node.symbols = path(t.NAME)
+        return node
 
     @_('SYMBOL')
     def expr(self, t):
-        return Node('symbol', t.SYMBOL)
+        return Node('symbol', t.SYMBOL, line=t.lineno)
 
     @_('STRING')
     def expr(self, t):
-        return Node('string', t.STRING)
+        return Node('string', data.unescape(t.STRING[1:-1]), line=t.lineno)
 
     @_('NUMBER')
     def expr(self, t):
-        return Node('number', t.NUMBER)
+        return Node('number', t.NUMBER, line=t.lineno)
 
     @_('expr "." NAME')
     def expr(self, t):
-        return Node('child', t.expr, t.NAME)
+        node = Node('child', t.expr, t.NAME, line=t.lineno)
+        node.symbol = data.intern(t.NAME)
+        return node
@@ -0,0 +1,89 @@
+import errors
+import json
+import runner
+import sys
+import time
+
+# --profile swaps in a Program.run that times every statement, and every func body it
+# runs, so nothing is measured (or slowed down) unless it was asked for
+
+class Stat():
+    __slots__ = ('calls', 'total', 'own', 'active')
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0 # includes everything run on the way, counted once for recursion
+        self.own = 0.0
+        self.active = 0
+
+funcs = {} # (name, file, line) -> Stat
+lines = {} # (file, line) -> Stat
+# [stat, start, time spent in nested entries] for the funcs and statements running now,
+# kept apart so a func's self time only leaves out the funcs it calls
+calls = []
+statements = []
+
+def enter(stack, stat):
+    stat.calls += 1
+    stat.active += 1
+    stack.append([stat, time.perf_counter(), 0.0])
+
+def leave(stack):
+    stat, start, nested = stack.pop()
+    spent = time.perf_counter() - start
+    stat.own += spent - nested
+    stat.active -= 1
+    if not stat.active:
+        stat.total += spent
+    if stack:
+        stack[-1][2] += spent
+
+def run(self):
+    ast = self.ast
+    if not ast.val:
+        return
+    if self.globals.layout is not ast.layout:
+        self.globals.adopt(ast.layout)
+    func = ast.func
+    if func is not None:
+        enter(calls, funcs.setdefault(func, Stat()))
+    file = ast.file
+    try:
+        last = len(ast.val) - 1
+        for i, node in enumerate(ast.val):
+            enter(statements, lines.setdefault((file, node.line or 0), Stat()))
+            try:
+                val = runner.expr(node, self.globals)
+            finally:
+                leave(statements)
+            if val or i == last:
+                return val
+    except Exception as e:
+        errors.error(f'Python threw error: {type(e).__name__} {e}')
+    finally:
+        if func is not None:
+            leave(calls)
+
+def start():
+    runner.Program.run = run
+
+def rows(stats):
+    return sorted(stats.items(), key=lambda item: item[1].own, reverse=True)
+
+def report(out=sys.stderr, limit=20):
+    print('\nfunc                                      calls      total       self', file=out)
+    for (name, file, line), stat in rows(funcs)[:limit]:
+        where = f'{name} {runner.relative(file)}:{line}'
+        print(f'{where:<40} {stat.calls:>7} {stat.total:>9.4f}s {stat.own:>9.4f}s', file=out)
+    print('\nline                                      calls      total       self', file=out)
+    for (file, line), stat in rows(lines)[:limit]:
+        where = f'{runner.relative(file)}:{line}'
+        print(f'{where:<40} {stat.calls:>7} {stat.total:>9.4f}s {stat.own:>9.4f}s', file=out)
+
+def dump(path):
+    entry = lambda stat: {'calls':stat.calls, 'total':stat.total, 'self':stat.own}
+    out = {
+        'funcs':[{'name':name, 'file':runner.relative(file), 'line':line, **entry(stat)} for (name, file, line), stat in rows(funcs)],
+        'lines':[{'file':runner.relative(file), 'line':line, **entry(stat)} for (file, line), stat in rows(lines)],
+    }
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=1)
@@ -0,0 +1,127 @@
+# blocks handed straight to these run inside the caller's scope, so they share its layout
+shared = ('if', 'while')
+# operators that store into their left side, which has to stay a Reference
+assigns = ('=', '+=', '-=', '*=', '/=')
+
+class Layout():
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.frames = [] # pooled call frames for funcs whose body uses this layout
+    def __getstate__(self):
+        return {'names':self.names, 'index':self.index}
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = []
+    def __repr__(self):
+        return f'<Layout {", ".join(self.names)}>'
+    def slot(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+# reading an outer name copies it into the local scope, so every name a region
+# touches gets a local slot and misses fall back to the dynamic lookup
+def resolve(program, layout=None):
+    if layout is None:
+        if hasattr(program, 'layout'):
+            return program
+        layout = Layout()
+    program.layout = layout
+    for node in program.val:
+        walk(node, layout)
+    return program
+
+# a name only read for its value becomes a value node, which loads the slot itself
+def value(node, layout):
+    walk(node, layout)
+    if node.type == 'name':
+        node.type = 'value'
+
+def walk(node, layout):
+    if node.type == 'name':
+        node.layout = layout
+        node.slot = layout.slot(node.symbols[0].val)
+    elif node.type == 'decl':
+        node.layout = layout
+        node.slot = layout.slot(node.symbol.val)
+        if len(node.val) == 3:
+            args(node.val[2].val, layout)
+    elif node.type == 'call':
+        name = called(node)
+        value(node.val[0], layout)
+        if name in shared:
+            args(node.val[1].val, layout, layout)
+        else:
+            args(node.val[1].val, layout)
+            if name == 'func':
+                for arg in node.val[1].val:
+                    if arg.type == 'block':
+                        tails(arg.val[0])
+    elif node.type == 'block':
+        resolve(node.val[0], Layout())
+    elif node.type == 'op':
+        if node.val[1] in assigns:
+            walk(node.val[0], layout)
+        else:
+            value(node.val[0], layout)
+        value(node.val[2], layout)
+    elif node.type == 'index':
+        value(node.val[0], layout)
+        value(node.val[1], layout)
+    elif node.type == 'child':
+        value(node.val[0], layout)
+    elif node.type == 'array':
+        for item in node.val[0].val:
+            value(item, layout)
+
+def called(node): # the name a call node calls, if it calls one directly
+    callee = node.val[0]
+    if callee.type in ('name', 'value'):
+        return callee.val[0]
+
+def args(nodes, layout, inner=None):
+    for node in nodes:
+        if node.type == 'decl':
+            continue # parameter or loop variable, bound by the callee
+        elif node.type == 'block' and inner is not None:
+            resolve(node.val[0], inner)
+        else:
+            walk(node, layout)
+
+# return(f(...)) as the last thing a func body does, directly or inside an if,
+# becomes a tail node so the call can reuse the returning frame
+def tails(program):
+    for node in program.val:
+        name = called(node) if node.type == 'call' else None
+        if name is None:
+            continue
+        nodes = node.val[1].val
+        if name == 'return' and len(nodes) == 1 and nodes[0].type == 'call':
+            nodes[0].type = 'tail'
+        elif name == 'if':
+            for arg in nodes:
+                if arg.type == 'block':
+                    tails(arg.val[0])
+
+# every program node learns its file, and the body of func(...) { ... } also gets
+# (name, file, line) naming it after the variable it is assigned to, for tracing
+def locate(node, file, name=None):
+    if node.type == 'program':
+        node.file = file
+    if node.type == 'op' and node.val[1] == '=' and node.val[0].type == 'name':
+        locate(node.val[2], file, node.val[0].val[0])
+        return
+    defines = node.type in ('call', 'tail') and called(node) in ('func', 'memo')
+    for val in node.val:
+        if isinstance(val, str):
+            continue
+        if defines and val.type == 'list':
+            for arg in val.val:
+                if arg.type == 'block':
+                    arg.val[0].func = (name or '<func>', file, node.line or 0)
+                locate(arg, file, name)
+        else:
+            locate(val, file)
+    return node
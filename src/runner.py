@@ -1,6 +1,10 @@
 import data
 import errors
+import functools
+import parallel
 import parse
+import cache
+import resolve
 import os
 import os.path
 
@@ -8,49 +12,97 @@ PRIVATE = 2
 PROTECTED = 1
 PUBLIC = 0
 
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+modules = {} # resolved path -> module globals, shared by every importer
+
+def locate(name):
+    base = root if name.startswith('stdlib') else os.getcwd()
+    for ext in ('.qyl', '.py'):
+        path = os.path.realpath(os.path.join(base, f'{name}{ext}'))
+        if os.path.isfile(path):
+            return path
+
+def relative(path): # shorter paths for messages, relative to the working directory or the install
+    for base in (os.getcwd(), root):
+        out = os.path.relpath(path, base) if os.path.isabs(path) else path
+        if not out.startswith('..'):
+            return out
+    return path
+
+INDEX = data.intern('index')
+
+@functools.lru_cache(maxsize=1024)
+def compiled(code): # one entry per py() call site, unless the code is built at runtime
+    try:
+        return compile(code, '<py>', 'eval'), False
+    except SyntaxError: # statements after the value, like 'x; y', which ran as 'out = x; y'
+        return compile(f'out = {code}', '<py>', 'exec'), True
+
 rw = lambda name: len(name) - len(name.lstrip('_'))
 
 type_method = lambda type, *other: data.Method(lambda *args: type if not args or len(args) < len(other) else type(*other, *args))
 
+def decl(val, scope, args=None):
+    t = data.call(data.get_path(scope, val.symbols))
+    if t == data.Number:
+        default = data.Number(0)
+    elif t == data.String:
+        default = data.String('')
+    elif t == data.Bool:
+        default = data.Bool(False)
+    elif t == data.Func or t == data.Memo:
+        default = data.Func(scope, data.Block(Program(parse.Node('program'))))
+        default.val.val.globals = scope
+        if t == data.Memo:
+            default = data.Memo(default)
+    elif t == data.Class:
+        default = data.Class(data.Block(Program(parse.Node('program'))))
+    elif t == data.List:
+        default = data.List(data.Type)
+    elif t == data.StringBuilder:
+        default = data.StringBuilder()
+    elif t == data.Map:
+        default = data.Map()
+    elif t == data.Range:
+        default = data.Range(data.Number(0))
+    elif t == data.Iterator:
+        default = data.Iterator(iter(()))
+    elif t == data.PyType:
+        default = data.PyType(None)
+    elif isinstance(t, type) and issubclass(t, data.Type):
+        default = data.box(t, None) # filled in by the first assignment
+    else:
+        try:
+            default = data.call(t)
+        except:
+            default = t
+    if len(val.val) == 3:
+        func = data.get(scope, val.val[0]).to
+        scope.set(val.symbol, data.call(func, *args))
+    else:
+        scope.set(val.symbol, default)
+
 def expr(val, scope):
-    if val.type == 'string':
-        return data.String(val.val[0])
+    if val.type == 'value':
+        return data.get_value(scope, val.layout, val.slot, val.symbols)
+    elif val.type == 'string':
+        return data.box(data.String, val.val[0])
     elif val.type == 'number':
         return data.Number(val.val[0])
     elif val.type == 'decl':
-        t = data.call(data.get_name(scope, val.val[0]))
-        if t == data.Number:
-            default = data.Number(0)
-        elif t == data.String:
-            default = data.String('')
-        elif t == data.Func:
-            default = data.Func(scope, data.Block(Program(parse.Node('program'))))
-            default.val.val.globals = scope
-        elif t == data.Class:
-            default = data.Class(data.Block(Program(parse.Node('program'))))
-        elif t == data.List:
-            default = data.List(data.Type)
-        elif t == data.PyType:
-            default = data.PyType(None)
-        else:
-            try:
-                default = data.call(t)
-            except:
-                default = t
+        args = None
         if len(val.val) == 3:
-            func = data.get(scope, val.val[0]).to
             args = []
             for arg in val.val[2].val:
                 if arg.type == 'decl':
                     args.append(arg)
                 else:
                     args.append(expr(arg, scope))
-            scope.set(data.Symbol(val.val[1]), data.call(func, *args))
-        else:
-            scope.set(data.Symbol(val.val[1]), default)
+        decl(val, scope, args)
     elif val.type == 'name':
-        return data.get_name(scope, val.val[0])
-    elif val.type == 'call':
+        return data.get_slot(scope, val.layout, val.slot, val.symbols)
+    elif val.type == 'call' or val.type == 'tail':
         func = expr(val.val[0], scope)
         args = []
         for arg in val.val[1].val:
@@ -58,12 +110,16 @@ def expr(val, scope):
                 args.append(arg)
             else:
                 args.append(expr(arg, scope))
+        if val.type == 'tail':
+            return data.tail(func, *args)
         return data.call(func, *args)
     elif val.type == 'op':
         a = expr(val.val[0], scope)
-        func = data.op(a, data.Symbol(val.val[1]))
+        func = data.op(a, val.symbol)
         return data.call(func, expr(val.val[2], scope))
     elif val.type == 'block':
+        if val.val[0].layout is scope.layout:
+            return data.Block(Program.inline(val.val[0], scope), scope)
         program = Program(val.val[0])
         return data.Block(program, scope)
     elif val.type == 'array':
@@ -71,90 +127,136 @@ def expr(val, scope):
         for item in val.val[0].val:
             array.append(expr(item, scope))
         if val.val[0].val:
-            return data.List(type(array[0]), *array)
+            return data.List(type(data.ref(array[0])), *array)
         else:
             return data.List(data.Type)
     elif val.type == 'index':
-        index = data.op(expr(val.val[0], scope), data.Symbol('index'))
+        index = data.op(expr(val.val[0], scope), INDEX)
         return data.call(index, expr(val.val[1], scope))
     elif val.type == 'child':
-        return data.get(expr(val.val[0], scope), val.val[1])
+        return data.get(expr(val.val[0], scope), val.symbol)
     elif val.type == 'bool':
         if val.val[0] == 'true':
             return data.Bool(True)
         else:
             return data.Bool(False)
 
+events = ('call', 'return', 'statement', 'exception')
+
 class Program():
+    hooks = {event:[] for event in events} # shared by every program and engine
     def __init__(self, ast):
-        self.ast = ast
-        self.globals = data.Map(data.Symbol, data.Type)
-        self.globals.set(data.Symbol('import'), data.Method(self._import))
-        self.globals.set(data.Symbol('if'), data.Method(self._if))
-        self.globals.set(data.Symbol('while'), data.LazyMethod(self._while))
-        self.globals.set(data.Symbol('return'), data.Method(lambda val: val))
-        self.globals.set(data.Symbol('py'), data.Method(self.py))
-        self.globals.set(data.Symbol('inf'), data.Number(float('inf')))
-        self.globals.set(data.Symbol('infinity'), data.Number(float('inf')))
-        self.globals.set(data.Symbol('number'), type_method(data.Number))
-        self.globals.set(data.Symbol('string'), type_method(data.String))
-        self.globals.set(data.Symbol('func'), type_method(data.Func, self.globals))
-        self.globals.set(data.Symbol('class'), type_method(data.Class))
-        self.globals.set(data.Symbol('list'), type_method(data.List))
-        self.globals.set(data.Symbol('range'), type_method(data.Range))
-        self.globals.set(data.Symbol('type'), type_method(data.Type))
-        self.globals.set(data.Symbol('symbol'), type_method(data.Symbol))
-        self.globals.set(data.Symbol('map'), type_method(data.Map))
-        self.globals.set(data.Symbol('bool'), type_method(data.Bool))
-        self.globals.set(data.Symbol('void'), data.Method(lambda: type(None)))
-        self.globals.set(data.Symbol('_pytype'), type_method(data.PyType))
+        self.ast = resolve.resolve(ast)
+        self.globals = data.Scope(ast.layout)
+        self.globals.set(data.intern('import'), data.Method(self._import))
+        self.globals.set(data.intern('reload'), data.Method(self._reload))
+        self.globals.set(data.intern('if'), data.Method(self._if))
+        self.globals.set(data.intern('while'), data.LazyMethod(self._while))
+        self.globals.set(data.intern('memo'), type_method(data.Memo))
+        self.globals.set(data.intern('pmap'), data.Method(parallel.pmap))
+        self.globals.set(data.intern('parallel_each'), data.Method(parallel.parallel_each))
+        self.globals.set(data.intern('return'), data.Method(lambda val: val))
+        self.globals.set(data.intern('py'), data.Method(self.py))
+        self.globals.set(data.intern('extern'), data.Method(self._extern))
+        self.globals.set(data.intern('inf'), data.Number(float('inf')))
+        self.globals.set(data.intern('infinity'), data.Number(float('inf')))
+        self.globals.set(data.intern('number'), type_method(data.Number))
+        self.globals.set(data.intern('string'), type_method(data.String))
+        self.globals.set(data.intern('stringbuilder'), type_method(data.StringBuilder))
+        self.globals.set(data.intern('join'), data.Method(data.join))
+        self.globals.set(data.intern('func'), type_method(data.Func, self.globals))
+        self.globals.set(data.intern('class'), type_method(data.Class))
+        self.globals.set(data.intern('list'), type_method(data.List))
+        self.globals.set(data.intern('range'), type_method(data.Range))
+        self.globals.set(data.intern('iterator'), type_method(data.Iterator))
+        self.globals.set(data.intern('type'), type_method(data.Type))
+        self.globals.set(data.intern('symbol'), type_method(data.Symbol))
+        self.globals.set(data.intern('map'), type_method(data.Map))
+        self.globals.set(data.intern('bool'), type_method(data.Bool))
+        self.globals.set(data.intern('void'), data.Method(lambda: type(None)))
+        self.globals.set(data.intern('_pytype'), type_method(data.PyType))
+    # fn(event, name, file, line, arg) runs on every event it is hooked to: arg is the
+    # returned value for return, and the exception for exception
+    @classmethod
+    def hook(cls, event, fn):
+        if event not in events:
+            errors.error(f'Unknown trace event {event}, expected one of {", ".join(events)}')
+            return
+        Program.hooks[event].append(fn)
+        retrace()
+    @classmethod
+    def unhook(cls, event, fn):
+        if fn in Program.hooks.get(event, ()):
+            Program.hooks[event].remove(fn)
+            retrace()
+    @classmethod
+    def inline(cls, ast, scope):
+        program = cls.__new__(cls) # runs in the caller's scope, no builtins of its own
+        program.ast = ast
+        program.globals = scope
+        return program
+    def eval(self, node, scope):
+        return expr(node, scope)
     def py(self, *args):
-        code = args[0].val
-        d = {**globals(), **self.globals.attrs}
-        exec(f'out = {code}', d)
-        return d['out']
+        code, statements = compiled(args[0].val)
+        if not statements:
+            return eval(code, globals(), self.globals.visible())
+        names = {**globals(), **self.globals.visible()}
+        exec(code, names)
+        return names['out']
+    def _extern(self, target, *params):
+        return data.Func.extern(self.globals, target, *params)
     def print(self, *args): #recursion moment <----- recursion is its own reward
         for val in args: # also i found the problem
             print(data.call(data.get(val, '_string')).val) # i'm gonna fix it
     def _import(self, *args):
         name = args[0].val
-        try:
-            if name.startswith('stdlib'):
-                file = open((__file__.rstrip('/src/runner.py') + f'/{name}.qyl').lstrip('/'))
+        path = locate(name)
+        if not path:
+            errors.error('File not found')
+            return
+        if path not in modules:
+            self.load(path)
+        self.globals.set(data.intern(name.split('/')[-1]), modules[path])
+    def _reload(self, *args):
+        name = args[0].val
+        path = locate(name)
+        if not path:
+            errors.error('File not found')
+            return
+        self.load(path)
+        self.globals.set(data.intern(name.split('/')[-1]), modules[path])
+    def load(self, path):
+        if path.endswith('.qyl'):
+            program = type(self)(cache.load(path))
+            if path in modules:
+                program.globals = modules[path] # reload into the namespace everyone already shares
             else:
-                file = open(os.path.join(os.getcwd(), f'{name}.qyl'))
-            ast = parse.Parser().parse(parse.Lexer().tokenize(file.read()))
-            program = Program(ast)
+                modules[path] = program.globals # registered first so circular imports terminate
             program.run()
-            self.globals.set(data.Symbol(name.split('/')[-1]), program.globals)
-        except FileNotFoundError:
-            try:
-                if name.startswith('stdlib'):
-                    file = open((__file__.rstrip('/src/runner.py') + f'/{name}.py').lstrip('/'))
-                else:
-                    file = open(os.path.join(os.getcwd(), f'{name}.py'))
-                out = {}
-                exec(compile(file.read(), 'quill', 'exec'), out)
-                map = data.Map(data.Symbol, data.Type)
-                map.attrs.update(out['attrs'])
-                self.globals.set(data.Symbol(name.split('/')[-1]), map)
-            except FileNotFoundError:
-                errors.error('File not found')
+        else:
+            out = {}
+            exec(compile(open(path).read(), path, 'exec'), out)
+            if path not in modules:
+                modules[path] = data.Map(data.Symbol, data.Type)
+            modules[path].attrs.update(out['attrs'])
     def _if(self, *args):
         args[0].val.globals = self.globals
         if data.Bool(args[1]).val:
             return data.call(args[0])
     def _while(self, *args):
         args = list(args)
-        args[0] = expr(args[0], self.globals)
+        args[0] = self.eval(args[0], self.globals)
         args[0].val.globals = self.globals
         out = None
-        while data.Bool(expr(args[1], self.globals)).val:
+        while data.Bool(self.eval(args[1], self.globals)).val:
             out = data.call(args[0])
         return out
     def run(self):
         if not self.ast.val:
             return
+        if self.globals.layout is not self.ast.layout:
+            self.globals.adopt(self.ast.layout)
         try:
             for node in self.ast.val[:-1]:
                 val = expr(node, self.globals)
@@ -164,5 +266,60 @@ class Program():
         except Exception as e:
             errors.error(f'Python threw error: {type(e).__name__} {e}')
 
-def run(ast):
-    Program(ast).run()
+# with no hooks every engine keeps its own run, so tracing costs nothing until it is asked
+# for; while any are installed, all programs run through traced on the tree walker
+untraced = {}
+calls = [] # names of the traced funcs running now, innermost last
+
+def retrace():
+    on = any(Program.hooks.values())
+    for engine in (Program, *Program.__subclasses__()):
+        if engine not in untraced:
+            untraced[engine] = vars(engine).get('run')
+        if on:
+            engine.run = traced
+        elif untraced[engine] is not None:
+            engine.run = untraced[engine]
+        elif 'run' in vars(engine):
+            del engine.run
+
+def fire(event, name, file, line, arg=None):
+    for fn in Program.hooks[event]:
+        fn(event, name, file, line, arg)
+
+def traced(self):
+    ast = self.ast
+    if not ast.val:
+        return
+    if self.globals.layout is not ast.layout:
+        self.globals.adopt(ast.layout)
+    func = ast.func
+    if func is not None:
+        calls.append(func[0])
+        fire('call', *func)
+    name = calls[-1] if calls else '<module>'
+    out = None
+    try:
+        last = len(ast.val) - 1
+        for i, node in enumerate(ast.val):
+            fire('statement', name, ast.file, node.line or 0)
+            try:
+                val = expr(node, self.globals)
+            except BaseException as e:
+                if not getattr(e, 'traced', False): # only where it was raised
+                    e.traced = True
+                    fire('exception', name, ast.file, node.line or 0, e)
+                raise
+            if val or i == last:
+                out = val
+                break
+    except Exception as e:
+        errors.error(f'Python threw error: {type(e).__name__} {e}')
+    finally:
+        if func is not None:
+            calls.pop()
+            fire('return', *func, out)
+    return out
+
+def run(ast, engine=None):
+    (engine or Program)(ast).run()
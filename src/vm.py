@@ -0,0 +1,169 @@
+import data
+import errors
+import runner
+from compiler import *
+
+Reference = data.Reference
+Method = data.Method
+Func = data.Func
+Number = data.Number
+Bool = data.Bool
+empty = data.empty
+box = data.box
+binaries = data.binaries
+assignments = data.assignments
+missing = object()
+natives = {'if':runner.Program._if, 'while':runner.Program._while} # what BUILTIN checks for
+
+# operators and calls on plain values go straight to the method op() and call() would
+# have found, everything else takes the generic path
+def execute(code, scope):
+    ops = code.ops
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    while True:
+        op, arg = ops[pc]
+        pc += 1
+        if op == LOCAL:
+            layout, slot, symbols = arg
+            val = scope.slots[slot] if scope.layout is layout else None
+            push(data.get_value(scope, layout, slot, symbols) if val is None else val)
+        elif op == CALL:
+            if arg:
+                args = stack[-arg:]
+                del stack[-arg:]
+            else:
+                args = ()
+            func = pop()
+            t = type(func)
+            if t is Reference:
+                func = func.to
+                t = type(func)
+            if t is Method:
+                push(func.val(*args))
+            elif t is Func:
+                push(func.call(*args))
+            else:
+                push(data.call(func, *args))
+        elif op == BINARY:
+            b = pop()
+            a = pop()
+            if type(a) is Reference:
+                a = a.to
+            method = binaries.get((type(a), arg), missing)
+            if method is missing:
+                method = data.binary(type(a), arg)
+            if method is not None and a.attrs is empty:
+                push(method(a, b))
+            else:
+                push(data.call(data.op(a, arg), b))
+        elif op == POP_RETURN:
+            val = pop()
+            if val:
+                return val
+        elif op == NUMBER:
+            push(box(Number, arg))
+        elif op == ASSIGN:
+            b = pop()
+            a = pop()
+            method = None
+            if type(a) is Reference and a.to is not None and a.to.attrs is empty:
+                method = assignments.get((type(a.to), arg), missing)
+                if method is missing:
+                    method = data.assignment(type(a.to), arg)
+            if method is not None:
+                push(method(a, b))
+            else:
+                push(data.call(data.op(a, arg), b))
+        elif op == STEP:
+            val = pop()
+            if val:
+                stack[-1] = val
+                pc = arg
+        elif op == UNTIL:
+            val = pop()
+            if not (val.val if type(val) is Bool else Bool(val).val):
+                pc = arg
+        elif op == LAST:
+            stack[-1] = pop()
+            pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == UNLESS:
+            val = pop()
+            if not (val.val if type(val) is Bool else Bool(val).val):
+                push(None)
+                pc = arg
+        elif op == BUILTIN:
+            layout, slot, symbols, name, generic = arg
+            func = scope.slots[slot] if scope.layout is layout else None
+            if func is None:
+                func = data.get_value(scope, layout, slot, symbols)
+            method = func.val
+            if getattr(method, '__func__', None) is not natives[name] or method.__self__.globals is not scope:
+                pc = generic
+        elif op == NAME:
+            push(data.get_slot(scope, *arg))
+        elif op == BLOCK:
+            if arg.layout is scope.layout:
+                push(data.Block(Program.inline(arg, scope), scope))
+            else:
+                push(data.Block(Program(arg), scope))
+        elif op == RETURN:
+            return pop()
+        elif op == STRING:
+            push(box(data.String, arg))
+        elif op == CHILD:
+            push(data.get(pop(), arg))
+        elif op == CONST:
+            push(arg)
+        elif op == LAZY:
+            if isinstance(data.ref(stack[-1]), data.LazyMethod):
+                push(data.call(pop(), *arg[0]))
+                pc = arg[1]
+        elif op == LOAD:
+            push(data.get_value(scope, *arg))
+        elif op == OP:
+            push(data.op(pop(), arg))
+        elif op == DECL:
+            node, argc = arg
+            if argc:
+                args = stack[-argc:]
+                del stack[-argc:]
+                runner.decl(node, scope, args)
+            else:
+                runner.decl(node, scope)
+            push(None)
+        elif op == ARRAY:
+            if arg:
+                array = stack[-arg:]
+                del stack[-arg:]
+                push(data.List(type(data.ref(array[0])), *array))
+            else:
+                push(data.List(data.Type))
+        elif op == BOOL:
+            push(Bool(arg))
+        elif op == NONE:
+            push(None)
+        elif op == TAIL:
+            if arg:
+                args = stack[-arg:]
+                del stack[-arg:]
+                push(data.tail(pop(), *args))
+            else:
+                push(data.tail(pop()))
+
+class Program(runner.Program):
+    def eval(self, node, scope):
+        return execute(compile(node), scope)
+    def run(self):
+        if not self.ast.val:
+            return
+        if self.globals.layout is not self.ast.layout:
+            self.globals.adopt(self.ast.layout)
+        try:
+            return execute(compile(self.ast), self.globals)
+        except Exception as e:
+            errors.error(f'Python threw error: {type(e).__name__} {e}')
@@ -0,0 +1,200 @@
+import sys
+sys.path.append('../src')
+
+import builtins
+import data
+import errors
+import mmap
+import os
+
+modes = ('r', 'w', 'a', 'x', 'r+', 'w+', 'a+', 'x+')
+
+def text(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.String):
+        errors.error(f'{name} needs a string, got {val.typename}')
+    return val.val
+
+def number(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.Number):
+        errors.error(f'{name} needs a number, got {val.typename}')
+    return int(val.val)
+
+def stream(readline):
+    while True:
+        line = readline()
+        if not line:
+            return
+        yield data.box(data.String, line.rstrip('\r\n'))
+
+class File(data.Type):
+    __slots__ = ()
+    typename = 'File'
+    def __init__(self, handle):
+        self.val = handle
+        self.attrs = data.empty
+    def state(self):
+        if self.val is None:
+            errors.error('File is not open')
+        return self.val
+    def handle(self):
+        if self.state().closed:
+            errors.error('File is closed')
+        return self.val
+    def read(self, n=None):
+        size = -1 if n is None else number(n, 'read')
+        return data.box(data.String, self.handle().read(size))
+    def read_line(self):
+        return data.box(data.String, self.handle().readline().rstrip('\r\n'))
+    def iter(self):
+        return stream(self.handle().readline)
+    def lines(self):
+        return data.Iterator(self.iter())
+    def write(self, val):
+        self.handle().write(data.text(val))
+    def write_line(self, val):
+        handle = self.handle()
+        handle.write(data.text(val))
+        handle.write('\n')
+    def flush(self):
+        self.handle().flush()
+    def seek(self, pos):
+        self.handle().seek(number(pos, 'seek'))
+    def tell(self):
+        return data.Number(self.handle().tell())
+    def close(self):
+        self.state().close()
+    def string(self):
+        if self.val is None:
+            return data.String('<File>')
+        return data.String(f'<File {self.val.name} {self.val.mode}{" closed" if self.val.closed else ""}>')
+    methods = {
+        **data.adapters,
+        '_set':data.Type.set,
+        '_get':data.Type.get,
+        '_eq':data.Type.eq,
+        '_string':string,
+        '_iter':iter,
+        'read':read,
+        'read_line':read_line,
+        'lines':lines,
+        'write':write,
+        'write_line':write_line,
+        'flush':flush,
+        'seek':seek,
+        'tell':tell,
+        'close':close,
+    }
+
+# read only, pages come in from disk as they are touched
+class View(data.Type):
+    __slots__ = ()
+    typename = 'View'
+    def __init__(self, map):
+        self.val = map
+        self.attrs = data.empty
+    def state(self):
+        if self.val is None:
+            errors.error('View is not open')
+        return self.val
+    def handle(self):
+        if self.state().closed:
+            errors.error('View is closed')
+        return self.val
+    def size(self):
+        return data.Number(len(self.handle()))
+    def index(self, pos):
+        view = self.handle()
+        pos = number(pos, 'index')
+        if not -len(view) <= pos < len(view):
+            errors.error('Index too high')
+        return data.Number(view[pos])
+    def slice(self, start, end):
+        view = self.handle()
+        return data.box(data.String, view[number(start, 'slice'):number(end, 'slice')].decode('utf-8', 'replace'))
+    def find(self, val, start=None):
+        pos = 0 if start is None else number(start, 'find')
+        return data.Number(self.handle().find(text(val, 'find').encode('utf-8'), pos))
+    def iter(self):
+        view = self.handle()
+        pos = 0 # its own position, so several walks over one view don't interfere
+        def readline():
+            nonlocal pos
+            end = view.find(b'\n', pos)
+            end = len(view) if end == -1 else end + 1
+            line = view[pos:end].decode('utf-8', 'replace')
+            pos = end
+            return line
+        return stream(readline)
+    def lines(self):
+        return data.Iterator(self.iter())
+    def close(self):
+        self.state().close()
+    def string(self):
+        if self.val is None:
+            return data.String('<View>')
+        return data.String(f'<View {len(self.val) if not self.val.closed else "closed"}>')
+    methods = {
+        **data.adapters,
+        '_set':data.Type.set,
+        '_get':data.Type.get,
+        '_eq':data.Type.eq,
+        '_string':string,
+        '_index':index,
+        '_iter':iter,
+        'size':size,
+        'slice':slice,
+        'find':find,
+        'lines':lines,
+        'close':close,
+    }
+
+def open(*args):
+    if not 1 <= len(args) <= 3:
+        errors.error(f'open needs a name, and optionally a mode and buffer size, got {len(args)} arguments')
+    name = text(args[0], 'open')
+    mode = text(args[1], 'open') if len(args) > 1 else 'r'
+    if mode not in modes:
+        errors.error(f'Invalid file mode {mode}, expected one of {", ".join(modes)}')
+    buffering = number(args[2], 'open') if len(args) > 2 else -1
+    try:
+        return File(builtins.open(name, mode, buffering, encoding='utf-8'))
+    except OSError as e:
+        errors.error(f'Cannot open {name}: {e.strerror}')
+
+def view(*args):
+    if len(args) != 1:
+        errors.error(f'mmap needs exactly 1 argument, got {len(args)}')
+    name = text(args[0], 'mmap')
+    try:
+        with builtins.open(name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                errors.error(f'Cannot view {name}: file is empty')
+            return View(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except OSError as e:
+        errors.error(f'Cannot view {name}: {e.strerror}')
+
+def exists(*args):
+    if len(args) != 1:
+        errors.error(f'exists needs exactly 1 argument, got {len(args)}')
+    return data.Bool(os.path.exists(text(args[0], 'exists')))
+
+def size(*args):
+    if len(args) != 1:
+        errors.error(f'size needs exactly 1 argument, got {len(args)}')
+    name = text(args[0], 'size')
+    try:
+        return data.Number(os.path.getsize(name))
+    except OSError as e:
+        errors.error(f'Cannot stat {name}: {e.strerror}')
+
+# fs.file: f and fs.view: v declare variables of these types
+attrs = {
+    'file':data.Method(lambda *args: File),
+    'view':data.Method(lambda *args: View),
+    'open':data.Method(open),
+    'mmap':data.Method(view),
+    'exists':data.Method(exists),
+    'size':data.Method(size),
+}
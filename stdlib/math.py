@@ -0,0 +1,123 @@
+import sys
+sys.path.append('../src')
+
+import data
+import errors
+import math
+
+def number(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.Number):
+        errors.error(f'{name} needs a number, got {val.typename}')
+    return val.val
+
+def numbers(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.List) or val.type is not data.Number:
+        errors.error(f'{name} needs a list(number), got {val.typename}')
+    return val.val
+
+def arity(args, n, name):
+    if len(args) != n:
+        errors.error(f'{name} needs exactly {n} argument{"s" if n != 1 else ""}, got {len(args)}')
+
+def apply(fn, val, name):
+    try:
+        return fn(val)
+    except (ValueError, OverflowError) as e:
+        errors.error(f'{name}: {e}')
+
+# takes a number, or a list(number) and works on every item
+def elementwise(fn, name):
+    def method(*args):
+        arity(args, 1, name)
+        val = data.ref(args[0])
+        if isinstance(val, data.List):
+            return data.List.wrap(data.Number, [apply(fn, item, name) for item in numbers(val, name)])
+        return data.Number(apply(fn, number(val, name), name))
+    return data.Method(method)
+
+# takes two or more numbers, or a single list(number)
+def reduction(fn, name):
+    def method(*args):
+        if len(args) == 1:
+            vals = numbers(args[0], name)
+            if not vals:
+                errors.error(f'{name} of an empty list')
+        else:
+            if len(args) < 2:
+                errors.error(f'{name} needs a list or at least 2 arguments, got {len(args)}')
+            vals = [number(arg, name) for arg in args]
+        return data.Number(fn(vals))
+    return data.Method(method)
+
+def pow(*args):
+    arity(args, 2, 'pow')
+    exp = number(args[1], 'pow')
+    val = data.ref(args[0])
+    if isinstance(val, data.List):
+        return data.List.wrap(data.Number, [apply(lambda x: math.pow(x, exp), item, 'pow') for item in numbers(val, 'pow')])
+    return data.Number(apply(lambda x: math.pow(x, exp), number(val, 'pow'), 'pow'))
+
+def log(*args):
+    if len(args) == 2:
+        base = number(args[1], 'log')
+        fn = lambda x: math.log(x, base)
+    else:
+        arity(args, 1, 'log')
+        fn = math.log
+    val = data.ref(args[0])
+    if isinstance(val, data.List):
+        return data.List.wrap(data.Number, [apply(fn, item, 'log') for item in numbers(val, 'log')])
+    return data.Number(apply(fn, number(val, 'log'), 'log'))
+
+def atan2(*args):
+    arity(args, 2, 'atan2')
+    return data.Number(math.atan2(number(args[0], 'atan2'), number(args[1], 'atan2')))
+
+def fib(n):
+    if n < 0 or n != int(n):
+        raise ValueError('fibonacci needs a whole number that is not negative')
+    a, b = 0, 1
+    for _ in range(int(n)):
+        a, b = b, a + b
+    return float(a)
+
+def sum(*args):
+    arity(args, 1, 'sum')
+    return data.Number(math.fsum(numbers(args[0], 'sum')))
+
+def mean(*args):
+    arity(args, 1, 'mean')
+    vals = numbers(args[0], 'mean')
+    if not vals:
+        errors.error('mean of an empty list')
+    return data.Number(math.fsum(vals) / len(vals))
+
+attrs = {
+    'e':data.Number(math.e),
+    'pi':data.Number(math.pi),
+    'tau':data.Number(math.tau),
+    'pow':data.Method(pow),
+    'sqrt':elementwise(math.sqrt, 'sqrt'),
+    'exp':elementwise(math.exp, 'exp'),
+    'log':data.Method(log),
+    'log2':elementwise(math.log2, 'log2'),
+    'log10':elementwise(math.log10, 'log10'),
+    'floor':elementwise(math.floor, 'floor'),
+    'ceil':elementwise(math.ceil, 'ceil'),
+    'round':elementwise(round, 'round'),
+    'abs':elementwise(abs, 'abs'),
+    'min':reduction(min, 'min'),
+    'max':reduction(max, 'max'),
+    'sum':data.Method(sum),
+    'mean':data.Method(mean),
+    'sin':elementwise(math.sin, 'sin'),
+    'cos':elementwise(math.cos, 'cos'),
+    'tan':elementwise(math.tan, 'tan'),
+    'asin':elementwise(math.asin, 'asin'),
+    'acos':elementwise(math.acos, 'acos'),
+    'atan':elementwise(math.atan, 'atan'),
+    'atan2':data.Method(atan2),
+    'fibonacci':elementwise(fib, 'fibonacci'),
+}
@@ -0,0 +1,306 @@
+import sys
+sys.path.append('../src')
+
+import asyncio
+import codecs
+import data
+import errors
+
+# every server, connection and timer runs on this one loop, in the interpreter's
+# own thread, so handlers never run at the same time as each other
+loop = None
+active = 0 # servers, connections and timers still open; run() returns when this reaches 0
+done = None
+
+def text(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.String):
+        errors.error(f'{name} needs a string, got {val.typename}')
+    return val.val
+
+def number(val, name):
+    val = data.ref(val)
+    if not isinstance(val, data.Number):
+        errors.error(f'{name} needs a number, got {val.typename}')
+    return val.val
+
+def handler(val, name):
+    val = data.ref(val)
+    if not isinstance(val, (data.Func, data.Method)):
+        errors.error(f'{name} needs a func, got {val.typename}')
+    return val
+
+def get_loop():
+    global loop
+    if loop is None:
+        loop = asyncio.new_event_loop()
+    return loop
+
+def opened():
+    global active
+    active += 1
+
+def closed():
+    global active
+    active -= 1
+    if active == 0 and done is not None and not done.done():
+        done.set_result(None)
+
+def dispatch(fn, *args):
+    try:
+        data.call(fn, *args)
+    except Exception as e:
+        errors.error(f'Socket handler threw error: {type(e).__name__} {e}')
+
+# Conn and Server keep everything in val, so copies made by assignment share one connection
+class Connection(asyncio.Protocol):
+    def __init__(self, on_data, on_open=None, on_close=None, timeout=None):
+        self.on_data = on_data
+        self.on_open = on_open
+        self.on_close = on_close
+        self.timeout = timeout
+        self.transport = None
+        self.pending = [] # writes made before a connect has finished
+        self.timed_out = False
+        self.timer = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.conn = Conn(self)
+    def connection_made(self, transport):
+        opened()
+        self.transport = transport
+        self.touch()
+        if self.pending:
+            transport.writelines(self.pending)
+        self.pending = None
+        if self.on_open is not None:
+            dispatch(self.on_open, self.conn)
+    def data_received(self, chunk):
+        self.touch()
+        out = self.decoder.decode(chunk)
+        if out:
+            dispatch(self.on_data, self.conn, data.box(data.String, out))
+    def eof_received(self):
+        out = self.decoder.decode(b'', True)
+        if out:
+            dispatch(self.on_data, self.conn, data.box(data.String, out))
+    # a slow reader stops us reading from it until it has caught up
+    def pause_writing(self):
+        self.transport.pause_reading()
+    def resume_writing(self):
+        self.transport.resume_reading()
+    def touch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.timeout is not None and self.transport is not None:
+            self.timer = get_loop().call_later(self.timeout, self.expire)
+    def expire(self):
+        self.timed_out = True
+        self.transport.close()
+    def connection_lost(self, exc):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.on_close is not None:
+            dispatch(self.on_close, self.conn)
+        closed()
+
+class Conn(data.Type):
+    __slots__ = ()
+    typename = 'Conn'
+    def __init__(self, protocol):
+        self.val = protocol
+        self.attrs = data.empty
+    def state(self):
+        if self.val is None:
+            errors.error('Conn is not connected')
+        return self.val
+    def write(self, val):
+        conn = self.state()
+        out = data.text(val).encode('utf-8')
+        if conn.transport is None and conn.pending is not None:
+            conn.pending.append(out)
+        elif conn.transport is None or conn.transport.is_closing():
+            errors.error('Conn is closed')
+        else:
+            conn.transport.write(out)
+    def write_line(self, val):
+        self.write(data.String(data.text(val) + '\n'))
+    def close(self):
+        conn = self.state()
+        if conn.transport is not None:
+            conn.transport.close()
+        else:
+            conn.pending = None
+    def timeout(self, seconds):
+        conn = self.state()
+        conn.timeout = number(seconds, 'timeout')
+        conn.touch()
+    def is_open(self):
+        conn = self.val
+        return data.Bool(conn is not None and conn.transport is not None and not conn.transport.is_closing())
+    def is_timed_out(self):
+        return data.Bool(self.val is not None and self.val.timed_out)
+    def peer(self):
+        if self.val is None or self.val.transport is None:
+            return ('', 0)
+        return self.val.transport.get_extra_info('peername') or ('', 0)
+    def ip(self):
+        return data.String(self.peer()[0])
+    def port(self):
+        return data.Number(self.peer()[1])
+    def string(self):
+        ip, port = self.peer()
+        return data.String(f'<Conn {ip}:{port}{"" if self.is_open().val else " closed"}>')
+    methods = {
+        '_set':data.Type.set,
+        '_get':data.Type.get,
+        '_eq':data.Type.eq,
+        '_string':string,
+        'write':write,
+        'write_line':write_line,
+        'close':close,
+        'timeout':timeout,
+        'open':is_open,
+        'timed_out':is_timed_out,
+        'ip':ip,
+        'port':port,
+    }
+
+class Listener():
+    def __init__(self, on_data):
+        self.on_data = on_data
+        self.on_open = None
+        self.on_close = None
+        self.timeout = None
+        self.server = None
+    def protocol(self):
+        return Connection(self.on_data, self.on_open, self.on_close, self.timeout)
+
+class Server(data.Type):
+    __slots__ = ()
+    typename = 'Server'
+    def __init__(self, listener):
+        self.val = listener
+        self.attrs = data.empty
+    def state(self):
+        if self.val is None:
+            errors.error('Server is not listening')
+        return self.val
+    def set_open(self, fn):
+        self.state().on_open = handler(fn, 'on_open')
+    def set_close(self, fn):
+        self.state().on_close = handler(fn, 'on_close')
+    def timeout(self, seconds):
+        self.state().timeout = number(seconds, 'timeout')
+    def port(self):
+        sockets = self.state().server.sockets
+        return data.Number(sockets[0].getsockname()[1] if sockets else 0)
+    def close(self):
+        server = self.state().server
+        if server.is_serving():
+            server.close()
+            closed()
+    def string(self):
+        if self.val is None:
+            return data.String('<Server>')
+        return data.String(f'<Server {self.port().val:g}{"" if self.val.server.is_serving() else " closed"}>')
+    methods = {
+        '_set':data.Type.set,
+        '_get':data.Type.get,
+        '_eq':data.Type.eq,
+        '_string':string,
+        'on_open':set_open,
+        'on_close':set_close,
+        'timeout':timeout,
+        'port':port,
+        'close':close,
+    }
+
+def setup(coro, name):
+    if get_loop().is_running():
+        errors.error(f'{name} has to be called outside of a handler')
+    try:
+        return loop.run_until_complete(coro)
+    except asyncio.TimeoutError:
+        errors.error(f'{name} timed out')
+    except OSError as e:
+        errors.error(f'{name} failed: {e.strerror or e}')
+
+def listen(*args):
+    if len(args) != 3:
+        errors.error(f'listen needs a host, a port and a handler, got {len(args)} arguments')
+    host = text(args[0], 'listen')
+    port = int(number(args[1], 'listen'))
+    listener = Listener(handler(args[2], 'listen'))
+    listener.server = setup(get_loop().create_server(listener.protocol, host, port), 'listen')
+    opened()
+    return Server(listener)
+
+def connect(*args):
+    if not 3 <= len(args) <= 4:
+        errors.error(f'connect needs a host, a port, a handler and optionally a timeout, got {len(args)} arguments')
+    host = text(args[0], 'connect')
+    port = int(number(args[1], 'connect'))
+    on_data = handler(args[2], 'connect')
+    wait = number(args[3], 'connect') if len(args) > 3 else None
+    protocol = Connection(on_data)
+    start = get_loop().create_connection(lambda: protocol, host, port)
+    if loop.is_running():
+        # from inside a handler: hand back the connection now, writes queue until it is up
+        opened()
+        async def pending():
+            try:
+                await asyncio.wait_for(start, wait)
+            except (OSError, asyncio.TimeoutError) as e:
+                protocol.pending = None
+                errors.error(f'connect to {host}:{port} failed: {e.strerror if isinstance(e, OSError) else "timed out"}')
+            finally:
+                closed()
+        loop.create_task(pending())
+    else:
+        setup(asyncio.wait_for(start, wait), f'connect to {host}:{port}')
+    return protocol.conn
+
+def after(*args):
+    if len(args) != 2:
+        errors.error(f'after needs a delay and a func, got {len(args)} arguments')
+    seconds = number(args[0], 'after')
+    fn = handler(args[1], 'after')
+    def fire():
+        try:
+            dispatch(fn)
+        finally:
+            closed()
+    opened()
+    get_loop().call_later(seconds, fire)
+
+def run(*args):
+    global done
+    if len(args) > 1:
+        errors.error(f'run takes an optional time limit, got {len(args)} arguments')
+    limit = number(args[0], 'run') if args else None
+    if get_loop().is_running():
+        errors.error('run has to be called outside of a handler')
+    if active == 0:
+        return
+    done = loop.create_future()
+    try:
+        loop.run_until_complete(asyncio.wait_for(asyncio.shield(done), limit))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        done = None
+
+def stop(*args):
+    if done is not None and not done.done():
+        done.set_result(None)
+
+# socket.server: s and socket.conn: c declare variables of these types
+attrs = {
+    'server':data.Method(lambda *args: Server),
+    'conn':data.Method(lambda *args: Conn),
+    'listen':data.Method(listen),
+    'connect':data.Method(connect),
+    'after':data.Method(after),
+    'run':data.Method(run),
+    'stop':data.Method(stop),
+}